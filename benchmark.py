@@ -0,0 +1,277 @@
+"""Headless page benchmarks for erp_cinta.py.
+
+    python benchmark.py generate --rows 100000          # writes bench/data/*.csv
+    python benchmark.py run --rows 100000               # compare with the baseline
+    python benchmark.py run --rows 100000 --save-baseline
+
+Each page is rendered through Streamlit's AppTest harness three times, as a
+single run with the page already selected: cold (caches cleared) for
+latency, cold again under tracemalloc for peak memory and bytes read, and
+warm (caches kept) for latency. Results are compared with
+benchmark_baseline.json, keyed by storage backend and row count, and the
+run exits non-zero when a page regressed past the tolerance or there is no
+baseline to compare with.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(REPO_DIR, "erp_cinta.py")
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmark_baseline.json")
+BENCH_DIR = "bench"
+CHUNK_ROWS = 1_000_000
+PAGE_TIMEOUT_SECONDS = 600
+
+# (main menu, submenu radio key, submenu); Home also renders the sidebar leaderboards
+PAGES = [
+    ("Home", None, None),
+    ("Production Management", "production_submenu", "Production Tracking"),
+    ("Inventory Management", "inventory_submenu", "Stock Levels"),
+    ("Inventory Management", "inventory_submenu", "Reorder Alerts"),
+    ("Point of Sale (POS)", "pos_submenu", "Process Sale"),
+    ("Point of Sale (POS)", "pos_submenu", "View Sales History"),
+    ("Sales & Marketing", "sales_submenu", "Sales Performance"),
+    ("Sales & Marketing", "sales_submenu", "Customer Insights"),
+    ("Personnel Management", "personnel_submenu", "Employee Records"),
+    ("Personnel Management", "personnel_submenu", "Payroll Processing"),
+    ("Financial Management", "financial_submenu", "Revenue Tracking"),
+    ("Analytics & Reporting", "analytics_submenu", "Sales Analytics"),
+    ("Analytics & Reporting", "analytics_submenu", "Inventory Analytics"),
+    ("Analytics & Reporting", "analytics_submenu", "Financial Analytics"),
+]
+
+# A page regresses when a metric grows by more than the tolerance and by
+# more than this much in absolute terms (so noise on tiny numbers is ignored)
+REGRESSION_FLOORS = {
+    "cold_seconds": 0.05,
+    "warm_seconds": 0.05,
+    "peak_mb": 5.0,
+    "read_mb": 1.0,
+}
+
+# Synthetic Data
+PRODUCTS = ["Maize Flour", "Cooking Oil", "Sugar", "Milk", "Bread", "Rice", "Soap", "Tea Leaves", "Salt", "Wheat Flour"]
+PAYMENT_METHODS = ["Cash", "Card", "Mobile Money"]
+ROLES = ["Production", "Sales", "HR", "Finance"]
+STATUSES = ["Planned", "In Progress", "Completed"]
+
+def _ids(prefix, start, count):
+    return pd.Series(np.arange(start + 1, start + count + 1)).map(lambda number: f"{prefix}{number:03d}")
+
+def _dates(rng, count, days_back, days_forward=0):
+    today = np.datetime64(pd.Timestamp.today().normalize().date())
+    offsets = rng.integers(-days_back, days_forward + 1, count)
+    return pd.Series(today + offsets.astype("timedelta64[D]")).dt.strftime("%Y-%m-%d")
+
+def _catalog_names(count):
+    return pd.Series([f"{PRODUCTS[i % len(PRODUCTS)]} {i // len(PRODUCTS) + 1}" for i in range(count)])
+
+def _write_chunks(path, total, make_chunk):
+    for start in range(0, total, CHUNK_ROWS):
+        chunk = make_chunk(start, min(CHUNK_ROWS, total - start))
+        chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+def generate(directory, rows, seed=0):
+    """Write sales/financial tables of `rows` rows and proportionally smaller
+    inventory, production and employee tables to <directory>/data."""
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(directory, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    products = max(rows // 100, 50)
+    customers = max(rows // 20, 100)
+    employees = max(rows // 200, 20)
+    names = _catalog_names(products)
+    prices = rng.uniform(20, 2000, products).round(2)
+
+    def inventory(start, count):
+        stock = rng.integers(0, 500, count)
+        return pd.DataFrame({
+            "Product ID": _ids("P", start, count),
+            "Product Name": names[start:start + count].to_numpy(),
+            "Stock Quantity": stock,
+            "Reorder Level": rng.integers(5, 50, count),
+            "Last Restocked": _dates(rng, count, 90),
+            "Expiration Date": _dates(rng, count, 30, 365),
+            "Supplier": pd.Series(rng.integers(1, 200, count)).map(lambda n: f"Supplier {n}"),
+            "Barcode": pd.Series(rng.permutation(900000)[:count] + 100000).map(lambda n: f"CBW-{n}"),
+            "Unit Price": prices[start:start + count],
+        })
+
+    def sales(start, count):
+        product = rng.integers(0, products, count)
+        quantity = rng.integers(1, 10, count)
+        return pd.DataFrame({
+            "Sale ID": _ids("S", start, count),
+            "Product ID": pd.Series(product + 1).map(lambda n: f"P{n:03d}"),
+            "Product Name": names.to_numpy()[product],
+            "Quantity Sold": quantity,
+            "Total Price": (quantity * prices[product]).round(2),
+            "Sale Date": _dates(rng, count, 3 * 365),
+            "Customer Name": pd.Series(rng.integers(1, customers + 1, count)).map(lambda n: f"Customer {n}"),
+            "Payment Method": rng.choice(PAYMENT_METHODS, count),
+        })
+
+    def production(start, count):
+        return pd.DataFrame({
+            "Batch ID": _ids("B", start, count),
+            "Product Name": names.to_numpy()[rng.integers(0, products, count)],
+            "Raw Materials Used": "Mixed inputs",
+            "Quantity Produced": rng.integers(50, 5000, count),
+            "Production Date": _dates(rng, count, 3 * 365),
+            "Status": rng.choice(STATUSES, count),
+        })
+
+    def employee(start, count):
+        return pd.DataFrame({
+            "Employee ID": _ids("E", start, count),
+            "Employee Name": pd.Series(np.arange(start + 1, start + count + 1)).map(lambda n: f"Employee {n}"),
+            "Role": rng.choice(ROLES, count),
+            "Salary": rng.integers(15000, 400000, count),
+            "Join Date": _dates(rng, count, 10 * 365),
+            "Attendance": rng.integers(60, 101, count),
+        })
+
+    def financial(start, count):
+        kind = rng.choice(["Revenue", "Expense"], count)
+        return pd.DataFrame({
+            "Transaction ID": _ids("T", start, count),
+            "Description": np.where(kind == "Revenue", "Sales receipts", "Operating costs"),
+            "Amount": rng.uniform(100, 100000, count).round(2),
+            "Type": kind,
+            "Date": _dates(rng, count, 3 * 365),
+        })
+
+    tables = {
+        "inventory.csv": (products, inventory),
+        "sales.csv": (rows, sales),
+        "production.csv": (max(rows // 10, 10), production),
+        "employees.csv": (employees, employee),
+        "financial.csv": (rows, financial),
+    }
+    for filename, (count, make_chunk) in tables.items():
+        _write_chunks(os.path.join(data_dir, filename), count, make_chunk)
+        print(f"{filename}: {count:,} rows")
+
+# Page Runs
+def _bytes_read():
+    # rchar counts every byte read through read() syscalls, cached or not
+    try:
+        with open("/proc/self/io") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("rchar:"))
+    except (OSError, StopIteration):
+        return None
+
+def _clear_caches():
+    import streamlit as st
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+def _render(menu, submenu_key, submenu):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=PAGE_TIMEOUT_SECONDS)
+    # Select the page up front so the one timed run renders only that page
+    at.session_state["main_menu"] = menu
+    if submenu is not None:
+        at.session_state[submenu_key] = submenu
+    started = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"{menu} / {submenu}: {at.exception[0].value}")
+    if at.sidebar.radio(key="main_menu").value != menu or (submenu is not None and at.sidebar.radio(key=submenu_key).value != submenu):
+        raise RuntimeError(f"{menu} / {submenu}: the page was not selected")
+    return elapsed
+
+def run_page(menu, submenu_key, submenu):
+    _clear_caches()
+    cold = _render(menu, submenu_key, submenu)
+    _clear_caches()
+    read_before = _bytes_read()
+    tracemalloc.start()
+    _render(menu, submenu_key, submenu)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    read_after = _bytes_read()
+    warm = _render(menu, submenu_key, submenu)
+    return {
+        "cold_seconds": round(cold, 4),
+        "warm_seconds": round(warm, 4),
+        "peak_mb": round(peak / 2**20, 2),
+        "read_mb": round((read_after - read_before) / 2**20, 2) if read_before is not None else None,
+    }
+
+def run(directory):
+    # The app reads data/ and logo.png relative to the working directory
+    if not os.path.exists(os.path.join(directory, "logo.png")):
+        shutil.copy(os.path.join(REPO_DIR, "logo.png"), directory)
+    os.chdir(directory)
+    results = {}
+    for menu, submenu_key, submenu in PAGES:
+        page = f"{menu} / {submenu}" if submenu else menu
+        results[page] = run_page(menu, submenu_key, submenu)
+        print(f"{page:<50} " + "  ".join(f"{name}={value}" for name, value in results[page].items()))
+    return results
+
+# Baseline
+def compare(results, baseline, tolerance):
+    regressions = []
+    for page, metrics in results.items():
+        for name, value in metrics.items():
+            previous = baseline.get(page, {}).get(name)
+            if value is None or previous is None:
+                continue
+            if value > previous * (1 + tolerance) and value - previous > REGRESSION_FLOORS[name]:
+                regressions.append(f"{page}: {name} {previous} -> {value}")
+    return regressions
+
+def load_baselines():
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark erp_cinta.py pages on synthetic data.")
+    parser.add_argument("command", choices=["generate", "run"])
+    parser.add_argument("--rows", type=int, default=10_000, help="sales and financial rows (10k to 10M)")
+    parser.add_argument("--dir", default=None, help=f"data directory root (default {BENCH_DIR}/<rows>)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth before a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args(argv)
+    directory = os.path.abspath(args.dir or os.path.join(BENCH_DIR, str(args.rows)))
+
+    if args.command == "generate":
+        generate(directory, args.rows)
+        return 0
+
+    if not os.path.exists(os.path.join(directory, "data", "sales.csv")):
+        generate(directory, args.rows)
+    key = f"{os.environ.get('ERP_STORAGE', 'csv')}/{args.rows}"
+    results = run(directory)
+    baselines = load_baselines()
+    if args.save_baseline:
+        baselines[key] = results
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baseline {key} to {BASELINE_PATH}")
+        return 0
+    if key not in baselines:
+        print(f"No baseline for {key}; run with --save-baseline to store one.")
+        return 1
+    regressions = compare(results, baselines[key], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against baseline {key}.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,171 +1,3663 @@
+import time
+_IMPORTS_STARTED = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
 import random
-from datetime import datetime
-import matplotlib.pyplot as plt
-import cv2
+import bisect
+import csv
+import gc
+import heapq
+import importlib
+import itertools
+import json
+import os
+import pickle
+import queue
+import re
+import sqlite3
+import sys
+import subprocess
+import threading
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timedelta
 import numpy as np
-from PIL import Image
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error
+
+STARTUP_IMPORT_SECONDS = time.perf_counter() - _IMPORTS_STARTED
+
+# Garbage Collection
+# A table view rebuild allocates hundreds of thousands of long-lived objects
+# (search postings, lot lists, per-customer arrays). With the default
+# thresholds it runs a young collection every 700 allocations and several
+# full collections that walk everything built so far, over a second of a
+# 300k-item search build. While any rebuild runs young collections are made
+# rarer; the previous thresholds come back when the last one finishes.
+GC_THRESHOLDS = (50_000, 20, 10)
+
+class RebuildCollections:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.saved = None
+
+    def __enter__(self):
+        with self.lock:
+            if self.running == 0:
+                self.saved = gc.get_threshold()
+                gc.set_threshold(*GC_THRESHOLDS)
+            self.running += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                gc.set_threshold(*self.saved)
+        return False
+
+@st.cache_resource
+def _rebuild_collections():
+    return RebuildCollections()
+
+# Instrumentation
+# With ERP_METRICS=1, spans time table loads, saves, view rebuilds, model
+# fits and page sections, and count the rows and bytes they handle. Each
+# rerun's spans are appended to data/metrics.jsonl and process totals are
+# rewritten to data/metrics.prom (Prometheus text format); the sidebar's
+# Developer Panel shows both. When disabled, span() returns one shared
+# no-op object, so an instrumented call costs a function call and a check.
+METRICS_ENABLED = os.environ.get("ERP_METRICS", "0") not in ("", "0")
+METRICS_LOG_PATH = "data/metrics.jsonl"
+METRICS_PROM_PATH = "data/metrics.prom"
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, rows=0, nbytes=0):
+        pass
+
+_NO_SPAN = _NoSpan()
+# The current rerun's spans; every session reruns on its own thread
+_rerun = threading.local()
+
+class Span:
+    """Times a block and records it in the process totals and the current rerun."""
+
+    def __init__(self, metrics, name, label):
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+        self.rows = 0
+        self.nbytes = 0
+        self.seconds = None
+
+    def __enter__(self):
+        stack = getattr(_rerun, "stack", None)
+        self.depth = len(stack) if stack is not None else 0
+        if stack is not None:
+            stack.append(self)
+            _rerun.spans.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        stack = getattr(_rerun, "stack", None)
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.metrics.record(self.name, self.label, self.seconds, self.rows, self.nbytes)
+        return False
+
+    def add(self, rows=0, nbytes=0):
+        self.rows += int(rows)
+        self.nbytes += int(nbytes)
+
+class Metrics:
+    """Per (span, label) call count, total and max seconds, rows and bytes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, name, label, seconds, rows, nbytes):
+        with self.lock:
+            total = self.totals.setdefault((name, label or ""), [0, 0.0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+            total[3] += rows
+            total[4] += nbytes
+
+    def table(self):
+        with self.lock:
+            items = sorted(self.totals.items(), key=lambda item: -item[1][1])
+        return pd.DataFrame(
+            [(name, label, count, seconds * 1000, slowest * 1000, rows, nbytes) for (name, label), (count, seconds, slowest, rows, nbytes) in items],
+            columns=["Span", "Label", "Calls", "Total ms", "Max ms", "Rows", "Bytes"],
+        )
+
+    def prometheus(self):
+        with self.lock:
+            items = sorted(self.totals.items())
+        lines = [
+            "# HELP erp_span_seconds Time spent in instrumented sections.",
+            "# TYPE erp_span_seconds summary",
+        ]
+        for (name, label), (count, seconds, _, _, _) in items:
+            labels = f'span="{name}",label="{label}"'
+            lines.append(f"erp_span_seconds_count{{{labels}}} {count}")
+            lines.append(f"erp_span_seconds_sum{{{labels}}} {seconds:.6f}")
+        for metric, position, help_text in [("erp_span_rows_total", 3, "Rows handled by instrumented sections."), ("erp_span_bytes_total", 4, "Bytes handled by instrumented sections.")]:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for (name, label), total in items:
+                lines.append(f'{metric}{{span="{name}",label="{label}"}} {total[position]}')
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def _metrics():
+    return Metrics()
+
+def span(name, label=None):
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return Span(_metrics(), name, label)
+
+def begin_rerun():
+    if METRICS_ENABLED:
+        _rerun.stack = []
+        _rerun.spans = []
+
+def end_rerun(page):
+    """Append this rerun's spans to the JSONL log and rewrite the Prometheus file."""
+    spans = getattr(_rerun, "spans", None)
+    if not METRICS_ENABLED or spans is None:
+        return
+    record = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "page": page,
+        "spans": [
+            {"span": item.name, "label": item.label, "depth": item.depth, "ms": round(item.seconds * 1000, 3), "rows": item.rows, "bytes": item.nbytes}
+            for item in spans if item.seconds is not None
+        ],
+    }
+    os.makedirs(os.path.dirname(METRICS_LOG_PATH), exist_ok=True)
+    with open(METRICS_LOG_PATH, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    _write_file_atomic(METRICS_PROM_PATH, lambda f: f.write(_metrics().prometheus()))
+    _rerun.stack = _rerun.spans = None
+
+def developer_panel():
+    if not METRICS_ENABLED:
+        return
+    st.sidebar.markdown("---")
+    if not st.sidebar.toggle("Developer Panel", key="developer_panel"):
+        return
+    spans = [item for item in getattr(_rerun, "spans", None) or [] if item.seconds is not None]
+    st.sidebar.caption("This rerun")
+    st.sidebar.dataframe(pd.DataFrame(
+        [("\u2003" * item.depth + item.name + (f" {item.label}" if item.label else ""), round(item.seconds * 1000, 2), item.rows, item.nbytes) for item in spans],
+        columns=["Span", "ms", "Rows", "Bytes"],
+    ), hide_index=True)
+    st.sidebar.caption("Since start")
+    st.sidebar.dataframe(_metrics().table().round(2), hide_index=True)
+    st.sidebar.caption(f"Frame cache: {cache_stats()}")
+    if WRITE_BEHIND:
+        st.sidebar.caption(f"Write queue: {_write_service().status()}")
+    st.sidebar.caption("Imports")
+    st.sidebar.dataframe(import_costs().round(1), hide_index=True)
+    st.sidebar.download_button("Download Metrics", _metrics().prometheus(), "metrics.prom", "text/plain")
+
+# Lazy Imports
+# OpenCV and Pillow are only needed by a few pages, so they are imported
+# the first time one of those pages (or a function that needs them) runs,
+# not when a worker starts. Each first import is timed and kept in
+# import_costs() with the page that triggered it.
+LAZY_MODULES = ["cv2", "PIL.Image"]
+
+@st.cache_resource
+def _import_costs():
+    return {}
+
+def lazy_import(name, page=None):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with span("import", name):
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        _import_costs()[name] = (time.perf_counter() - started, page)
+    return module
+
+def record_startup_imports():
+    # Kept from the first run in this process; later reruns find every module loaded
+    _import_costs().setdefault("(startup imports)", (STARTUP_IMPORT_SECONDS, None))
+
+def import_costs():
+    """DataFrame of startup and lazy import times in this process."""
+    costs = _import_costs()
+    return pd.DataFrame(
+        [(name, seconds * 1000, page) for name, (seconds, page) in costs.items()],
+        columns=["Module", "Import ms", "First Needed By"],
+    )
+
+def measure_import_costs():
+    """Cold import time of each dependency, each in a fresh interpreter."""
+    costs = {}
+    for name in ["streamlit", "pandas", "numpy", *LAZY_MODULES]:
+        code = f"import time; started = time.perf_counter(); import {name}; print(time.perf_counter() - started)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        costs[name] = float(result.stdout.strip()) if result.returncode == 0 else None
+    return costs
 
 # Utility Functions
 def generate_barcode():
-    return f"CBW-{random.randint(100000, 999999)}"
+    return get_barcode_index().new_barcode()
 
-def display_dataframe(df, title):
+def display_table(filename, title, where=None, key=None, page_sizes=(25, 50, 100, 250)):
+    """Paginated table: search, sort and paging run on the server, one page is sent."""
+    key = key or f"table_{table_name(filename)}"
     st.subheader(title)
-    st.dataframe(df)
+    columns = list(TABLE_SCHEMAS.get(filename, {}).get("columns", {}))
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    search = col1.text_input("Search", placeholder="Search all text columns", key=f"{key}_search")
+    sort_by = col2.selectbox("Sort by", ["(none)"] + columns, key=f"{key}_sort")
+    descending = col3.toggle("Descending", key=f"{key}_descending")
+    page_size = col4.selectbox("Rows", page_sizes, key=f"{key}_size")
+    page_number = st.session_state.get(f"{key}_page", 1)
+    page, total = load_page(
+        filename,
+        (page_number - 1) * page_size,
+        page_size,
+        sort_by=None if sort_by == "(none)" else sort_by,
+        ascending=not descending,
+        where=where,
+        search=search or None,
+    )
+    pages = max(1, -(-total // page_size))
+    if page_number > pages:
+        # Filters shrank the result below the current page
+        page_number = st.session_state[f"{key}_page"] = 1
+        page, total = load_page(filename, 0, page_size, None if sort_by == "(none)" else sort_by, not descending, where, search or None)
+    if page.empty and columns:
+        page = pd.DataFrame(columns=columns)
+    with span("render", f"table:{table_name(filename)}") as timing:
+        timing.add(len(page))
+        st.dataframe(page, hide_index=True)
+    col1, col2 = st.columns([1, 3])
+    col1.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    first = (page_number - 1) * page_size + 1 if total else 0
+    col2.caption(f"Rows {first:,}–{min(page_number * page_size, total):,} of {total:,} · page {page_number} of {pages:,}")
+
+def select_date_range(key, days=365):
+    # Defaults to the last `days` days; a half-picked range is open-ended
+    today = date.today()
+    picked = st.date_input("Period", value=(today - timedelta(days=days), today), key=key)
+    if not isinstance(picked, (list, tuple)):
+        return picked, picked
+    if len(picked) == 1:
+        return picked[0], None
+    return tuple(picked) if picked else None
 
 def save_to_csv(df, filename):
-    df.to_csv(filename, index=False)
+    storage = get_storage()
+    with _write_lock(), span("save", table_name(filename)) as timing:
+        timing.add(len(df))
+        storage.write(df, filename)
+        _frame_cache().invalidate(filename)
+
+def append_to_csv(rows, filename):
+    """Append rows to a table; a row whose key already exists replaces it."""
+    if not rows:
+        return
+    storage = get_storage()
+    with _write_lock(), span("append", table_name(filename)) as timing:
+        timing.add(len(rows))
+        before = storage.signature(filename)
+        storage.append(rows, filename)
+        after = storage.signature(filename)
+        _frame_cache().invalidate(filename)
+        for view in _table_views(filename):
+            view.apply(rows, before, after)
+
+def commit_tables(batches):
+    """Append {filename: rows} to several tables as one all-or-nothing write."""
+    batches = {filename: rows for filename, rows in batches.items() if rows}
+    if not batches:
+        return
+    storage = get_storage()
+    with _write_lock(), span("commit", ",".join(table_name(filename) for filename in batches)) as timing:
+        timing.add(sum(len(rows) for rows in batches.values()))
+        before = {filename: storage.signature(filename) for filename in batches}
+        storage.append_many(batches)
+        for filename, rows in batches.items():
+            after = storage.signature(filename)
+            _frame_cache().invalidate(filename)
+            for view in _table_views(filename):
+                view.apply(rows, before[filename], after)
+
+def plain_rows(df):
+    """Table rows as dicts of plain Python values, ready to write back."""
+    rows = []
+    for row in df.astype(object).to_dict("records"):
+        rows.append({
+            column: value.strftime("%Y-%m-%d") if isinstance(value, pd.Timestamp) else value
+            for column, value in row.items() if not pd.isna(value)
+        })
+    return rows
+
+def load_from_csv(filename, where=None, columns=None, date_range=None):
+    """Load a table, optionally only the rows matching where={column: value},
+    the given columns and rows whose date column falls in date_range=(start, end).
+    The frame shares its data with the cache: callers may add or replace
+    columns, but must copy before changing values in place."""
+    # A shallow copy: new and replaced columns stay out of the cached frame
+    with span("load", table_name(filename)) as timing:
+        df = _load_cached(filename, where, columns, date_range)[1].copy(deep=False)
+        if METRICS_ENABLED:
+            timing.add(len(df), df.memory_usage(index=False).sum())
+    return df
+
+def _load_cached(filename, where=None, columns=None, date_range=None):
+    cache = _frame_cache()
+    storage = get_storage()
+    key = (filename, _where_key(where), tuple(columns) if columns is not None else None, tuple(date_range) if date_range else None)
+    signature = storage.signature(filename)
+    df = cache.get(key, signature)
+    if df is None:
+        if (where or columns is not None or date_range) and not storage.indexed:
+            # Without indexes a filter is a scan of the cached full table
+            signature, df = _load_cached(filename)
+            with span("filter", table_name(filename)) as timing:
+                df = _select_rows(df, filename, where, columns, date_range)
+                timing.add(len(df))
+        else:
+            with span("read", table_name(filename)) as timing:
+                signature, df = _read_table_consistent(storage, filename, where, columns, date_range)
+                if METRICS_ENABLED:
+                    timing.add(len(df), df.memory_usage(index=False).sum())
+        cache.put(key, signature, df)
+    return signature, df
+
+def _where_key(where):
+    if not where:
+        return None
+    return tuple(sorted((column, tuple(value) if isinstance(value, (list, tuple, set)) else value) for column, value in where.items()))
+
+def load_page(filename, offset, limit, sort_by=None, ascending=True, where=None, search=None):
+    """One page of a filtered, searched and sorted table, plus the total row count."""
+    storage = get_storage()
+    if hasattr(storage, "read_page"):
+        return storage.read_page(filename, offset, limit, sort_by, ascending, where, search)
+    # In-memory backends: keep the matching row order per query in the cache,
+    # so flipping pages is just a slice of the cached table
+    signature, df = _load_cached(filename, where)
+    cache = _frame_cache()
+    key = (filename, "page", _where_key(where), search or None, sort_by, ascending)
+    order = cache.get(key, signature)
+    if order is None:
+        positions = np.arange(len(df))
+        if search:
+            text_columns = [column for column in df.columns if not pd.api.types.is_numeric_dtype(df[column])]
+            mask = np.zeros(len(df), dtype=bool)
+            for column in text_columns:
+                mask |= df[column].astype(str).str.contains(search, case=False, regex=False).to_numpy(dtype=bool)
+            positions = positions[mask]
+        if sort_by in df.columns:
+            values = pd.Series(df[sort_by].to_numpy()[positions])
+            positions = positions[values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()]
+        order = pd.DataFrame({"position": positions})
+        cache.put(key, signature, order)
+    positions = order["position"].to_numpy()
+    return df.iloc[positions[offset:offset + limit]], len(positions)
+
+def _read_table_consistent(storage, filename, where=None, columns=None, date_range=None):
+    # Retry if a compaction swapped files underneath us while reading
+    while True:
+        signature = storage.signature(filename)
+        df = storage.read(filename, where, columns, date_range)
+        if storage.signature(filename) == signature:
+            return signature, df
+
+def _select_rows(df, filename, where=None, columns=None, date_range=None):
+    """Filter and project an in-memory table the way the indexed backends do."""
+    mask = pd.Series(True, index=df.index)
+    for column, value in (where or {}).items():
+        if column not in df.columns:
+            return df.iloc[0:0]
+        mask &= df[column].isin(value) if isinstance(value, (list, tuple, set)) else df[column] == value
+    date_column = TABLE_SCHEMAS.get(filename, {}).get("date_column")
+    if date_range and date_column in df.columns:
+        dates = pd.to_datetime(df[date_column], errors="coerce")
+        start, end = date_range
+        if start is not None:
+            mask &= dates >= pd.Timestamp(start)
+        if end is not None:
+            mask &= dates < pd.Timestamp(end) + pd.Timedelta(days=1)
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    return df if mask.all() else df[mask]
+
+def _table_signature(filename):
+    return get_storage().signature(filename)
+
+@st.cache_resource
+def _write_lock():
+    return threading.RLock()
+
+# Storage Backends
+# Every table is addressed by its CSV path (e.g. "data/sales.csv") whatever
+# the backend. ERP_STORAGE=csv (default) keeps whole-file CSVs with journals;
+# ERP_STORAGE=sqlite keeps the tables in SQLITE_PATH with typed columns and
+# indexes; ERP_STORAGE=parquet keeps typed columnar snapshots. Run
+# `python erp_cinta.py migrate-sqlite` (or migrate-parquet) once to copy the
+# CSVs, and `python erp_cinta.py export-csv` to write them back out.
+STORAGE_BACKEND = os.environ.get("ERP_STORAGE", "csv")
+SQLITE_PATH = "data/erp.sqlite3"
+
+TABLE_SCHEMAS = {
+    "data/sales.csv": {
+        "key": "Sale ID",
+        "columns": {
+            "Sale ID": "text",
+            "Product ID": "text",
+            "Product Name": "text",
+            "Quantity Sold": "integer",
+            "Total Price": "real",
+            "Sale Date": "date",
+            "Customer Name": "text",
+            "Payment Method": "category",
+        },
+        "indexes": ["Product Name", "Customer Name", "Sale Date"],
+        "date_column": "Sale Date",
+    },
+    "data/inventory.csv": {
+        "key": "Product ID",
+        "columns": {
+            "Product ID": "text",
+            "Product Name": "text",
+            "Stock Quantity": "integer",
+            "Reorder Level": "integer",
+            "Last Restocked": "date",
+            "Expiration Date": "date",
+            "Supplier": "text",
+            "Barcode": "text",
+            "Unit Price": "real",
+        },
+        "indexes": ["Product Name", "Barcode"],
+    },
+    "data/production.csv": {
+        "key": "Batch ID",
+        "columns": {
+            "Batch ID": "text",
+            "Product Name": "text",
+            "Raw Materials Used": "text",
+            "Quantity Produced": "integer",
+            "Production Date": "date",
+            "Status": "category",
+        },
+        "indexes": ["Product Name", "Production Date"],
+        "date_column": "Production Date",
+    },
+    "data/employees.csv": {
+        "key": "Employee ID",
+        "columns": {
+            "Employee ID": "text",
+            "Employee Name": "text",
+            "Role": "category",
+            "Salary": "real",
+            "Join Date": "date",
+            "Attendance": "real",
+        },
+        "indexes": ["Role"],
+        "date_column": "Join Date",
+    },
+    "data/financial.csv": {
+        "key": "Transaction ID",
+        "columns": {
+            "Transaction ID": "text",
+            "Description": "text",
+            "Amount": "real",
+            "Type": "category",
+            "Date": "date",
+        },
+        "indexes": ["Type", "Date"],
+        "date_column": "Date",
+    },
+    "data/sellers.csv": {
+        "key": "Customer Name",
+        "columns": {
+            "Customer Name": "text",
+            "Photo": "text",
+        },
+        "indexes": [],
+    },
+    "data/payslips.csv": {
+        "key": "Payslip ID",
+        "columns": {
+            "Payslip ID": "text",
+            "Run ID": "text",
+            "Pay Period": "text",
+            "Run Date": "date",
+            "Employee ID": "text",
+            "Employee Name": "text",
+            "Input Hash": "text",
+            "Salary": "real",
+            "Attendance": "real",
+            "Gross Pay": "real",
+            "NSSF": "real",
+            "SHIF": "real",
+            "Housing Levy": "real",
+            "Taxable Pay": "real",
+            "PAYE": "real",
+            "Total Deductions": "real",
+            "Net Pay": "real",
+        },
+        "indexes": ["Pay Period", "Employee ID", "Run ID"],
+        "date_column": "Run Date",
+    },
+    "data/formulations.csv": {
+        "key": "Line ID",
+        "columns": {
+            "Line ID": "text",
+            "Product Name": "text",
+            "Component": "text",
+            "Quantity": "real",
+        },
+        "indexes": ["Product Name", "Component"],
+    },
+}
+
+SQLITE_TYPES = {"text": "TEXT", "integer": "INTEGER", "real": "REAL", "date": "TEXT", "category": "TEXT"}
+
+def table_key(filename):
+    return TABLE_SCHEMAS.get(filename, {}).get("key")
+
+def table_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+@st.cache_resource
+def _storage(backend):
+    if backend == "sqlite":
+        storage = SqliteStorage(SQLITE_PATH)
+    elif backend == "parquet":
+        storage = ParquetStorage()
+    else:
+        storage = CsvStorage()
+    storage.recover()
+    return storage
+
+def get_storage():
+    return _storage(STORAGE_BACKEND)
+
+# DataFrame Cache
+# Parsed tables are shared by every session and rerun of the process. Each
+# entry is keyed by (table, filter) and tagged with the table's storage
+# signature (inode, mtime, size of the CSV snapshot and its journals, or the
+# SQLite table version), so a rerun with no new data does no parsing at all.
+FRAME_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+class FrameCache:
+    """LRU cache of DataFrames bounded by their in-memory size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, signature):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, df):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        with self.lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (signature, df, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        # Drops the full table and every filtered view of it
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == filename]:
+                self._discard(key)
+
+    def rebase(self, filename, old_signature, new_signature):
+        # Files were moved around without changing the table's contents
+        with self.lock:
+            for key, entry in self.entries.items():
+                if key[0] == filename and entry[0] == old_signature:
+                    self.entries[key] = (new_signature,) + entry[1:]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
 
-def load_from_csv(filename):
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+@st.cache_resource
+def _frame_cache():
+    return FrameCache(FRAME_CACHE_MAX_BYTES)
+
+def cache_stats():
+    return _frame_cache().stats()
+
+def _table_rebased(filename, old_signature, new_signature):
+    _frame_cache().rebase(filename, old_signature, new_signature)
+    for view in _table_views(filename):
+        view.rebase(old_signature, new_signature)
+
+# Incremental Table Views
+# Derived structures (leaderboards, indexes, rollups...) are built once from a
+# table and then fed the rows of every append, so pages never rescan history.
+# A view remembers the table signature it reflects; if the table changed
+# behind its back (e.g. an external edit) it is rebuilt on the next refresh.
+TABLE_VIEWS = {}
+
+class TableView:
+    """Structure derived from a table and updated incrementally on appends."""
+
+    filename = None
+
+    def __init__(self):
+        self.signature = None
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        with self.lock:
+            if self.signature != _table_signature(self.filename):
+                signature, df = _load_cached(self.filename)
+                with span("rebuild", type(self).__name__) as timing, _rebuild_collections():
+                    timing.add(len(df))
+                    self.reset()
+                    if not df.empty:
+                        self.update(df)
+                self.signature = signature
+        return self
+
+    def apply(self, rows, old_signature, new_signature):
+        with self.lock:
+            if self.signature == old_signature:
+                self.update(pd.DataFrame(rows))
+                self.signature = new_signature
+
+    def rebase(self, old_signature, new_signature):
+        with self.lock:
+            if self.signature == old_signature:
+                self.signature = new_signature
+
+    def invalidate(self):
+        # Rebuild from storage on the next refresh
+        with self.lock:
+            self.signature = None
+
+    def reset(self):
+        raise NotImplementedError
+
+    def update(self, df):
+        raise NotImplementedError
+
+def register_view(filename, factory):
+    TABLE_VIEWS.setdefault(filename, []).append(factory)
+
+def _table_views(filename):
+    return [factory() for factory in TABLE_VIEWS.get(filename, [])]
+
+# CSV Storage
+# Writers append new rows to "<table>.journal" instead of rewriting the
+# whole CSV. Readers see snapshot + journal, and a background thread folds
+# the journal into the snapshot once it grows past JOURNAL_COMPACT_BYTES.
+# A write that spans tables is first logged, as one fsynced line, to
+# TRANSACTION_LOG_PATH; the log is emptied once every journal has its rows,
+# and anything left in it after a crash is re-applied on startup. Rows are
+# keyed upserts with absolute values, so applying one twice is harmless.
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+TRANSACTION_LOG_PATH = "data/transactions.wal"
+
+class CsvStorage:
+    """Whole-file CSV snapshots plus append-only journals."""
+
+    indexed = False
+
+    def snapshot_path(self, filename):
+        return filename
+
+    def read_snapshot(self, path, columns=None, where=None, date_column=None, date_range=None):
+        return _read_csv_if_exists(path, columns)
+
+    def write_snapshot(self, df, path):
+        _write_file_atomic(path, lambda f: df.to_csv(f, index=False), newline="")
+
+    def snapshot_columns(self, path):
+        return _csv_header(path)
+
+    def signature(self, filename):
+        path = self.snapshot_path(filename)
+        return tuple(_file_stat(p) for p in (path, compacting_path(path), journal_path(path)))
+
+    def read(self, filename, where=None, columns=None, date_range=None):
+        path = self.snapshot_path(filename)
+        date_column = TABLE_SCHEMAS.get(filename, {}).get("date_column")
+        needed = None
+        if columns is not None:
+            # Journal rows replace snapshot rows by key, so the key is always read
+            needed = [table_key(filename)] + list(columns) + list(where or {}) + ([date_column] if date_range else [])
+            needed = [column for column in dict.fromkeys(needed) if column]
+        snapshot = self._cached_snapshot(path, needed, where, date_column, date_range)
+        pending = [df for df in (_read_csv_if_exists(compacting_path(path), needed), _read_csv_if_exists(journal_path(path), needed)) if df is not None]
+        if not pending:
+            df = snapshot if snapshot is not None else pd.DataFrame()
+        else:
+            frames = ([snapshot] if snapshot is not None else []) + pending
+            df = _dedupe_rows(pd.concat(frames, ignore_index=True), filename)
+        return _select_rows(df, filename, where, columns, date_range)
+
+    def _cached_snapshot(self, path, columns, where, date_column, date_range):
+        # Appends only touch the journal, so the parsed snapshot is cached under
+        # the snapshot file's own signature and only the journal is re-read
+        cache = _frame_cache()
+        key = (("snapshot", path), tuple(columns) if columns is not None else None, _where_key(where), tuple(date_range) if date_range else None)
+        signature = _file_stat(path)
+        snapshot = cache.get(key, signature)
+        if snapshot is None and signature is not None:
+            snapshot = self.read_snapshot(path, columns, where, date_column, date_range)
+            if snapshot is not None:
+                cache.put(key, signature, snapshot)
+        return snapshot
+
+    def write(self, df, filename):
+        path = self.snapshot_path(filename)
+        self.write_snapshot(df, path)
+        # The snapshot now holds everything, so pending journal rows are stale
+        for stale in (journal_path(path), compacting_path(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    def append(self, rows, filename):
+        """Append rows to the table's journal and fsync them."""
+        path = journal_path(self.snapshot_path(filename))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        columns = _csv_header(path) or self.snapshot_columns(self.snapshot_path(filename)) or list(rows[0].keys())
+        if any(column not in columns for row in rows for column in row):
+            # New columns can't be added to an open journal, fold it first
+            self.compact(filename)
+            columns = self.snapshot_columns(self.snapshot_path(filename)) or []
+            columns = list(dict.fromkeys(columns + [column for row in rows for column in row]))
+        write_header = _file_stat(path) is None
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval="")
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.getsize(path) >= JOURNAL_COMPACT_BYTES:
+            self.schedule_compaction(filename)
+
+    def append_many(self, batches):
+        """Append {filename: rows} to several tables, all or nothing."""
+        if len(batches) == 1:
+            (filename, rows), = batches.items()
+            return self.append(rows, filename)
+        os.makedirs(os.path.dirname(TRANSACTION_LOG_PATH) or ".", exist_ok=True)
+        with open(TRANSACTION_LOG_PATH, "a") as log:
+            log.write(json.dumps(batches, default=lambda value: value.item() if hasattr(value, "item") else str(value)) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        self._apply_logged(batches)
+        os.truncate(TRANSACTION_LOG_PATH, 0)
+
+    def _apply_logged(self, batches):
+        for filename, rows in batches.items():
+            if rows:
+                self.append(rows, filename)
+
+    def recover(self):
+        """Re-apply transactions that were logged but maybe not fully applied."""
+        try:
+            with open(TRANSACTION_LOG_PATH) as log:
+                lines = log.readlines()
+        except FileNotFoundError:
+            return 0
+        replayed = 0
+        for line in lines:
+            if not line.endswith("\n"):
+                # Torn write: the transaction never committed
+                continue
+            self._apply_logged(json.loads(line))
+            replayed += 1
+        os.truncate(TRANSACTION_LOG_PATH, 0)
+        return replayed
+
+    def schedule_compaction(self, filename):
+        running = _compactions_running()
+        path = self.snapshot_path(filename)
+        with _write_lock():
+            if path in running:
+                return
+            running.add(path)
+
+        def run():
+            try:
+                self.compact(filename)
+            finally:
+                with _write_lock():
+                    running.discard(path)
+
+        threading.Thread(target=run, name=f"compact-{path}", daemon=True).start()
+
+    def compact(self, filename):
+        """Fold the table's journal into its snapshot."""
+        path = self.snapshot_path(filename)
+        journal, compacting = journal_path(path), compacting_path(path)
+        # A leftover ".compacting" file (from a crash or a concurrent fold)
+        # goes first, then the live journal
+        for _ in range(2):
+            with _write_lock():
+                if _file_stat(compacting) is None:
+                    if _file_stat(journal) is None:
+                        return
+                    # New appends start a fresh journal while we fold this one
+                    before = self.signature(filename)
+                    os.replace(journal, compacting)
+                    _table_rebased(filename, before, self.signature(filename))
+                signature = _file_stat(compacting)
+            frames = [df for df in (self.read_snapshot(path), _read_csv_if_exists(compacting)) if df is not None]
+            df = _dedupe_rows(pd.concat(frames, ignore_index=True), filename) if frames else pd.DataFrame()
+            with _write_lock():
+                # save_to_csv or another fold may have replaced the table meanwhile
+                if _file_stat(compacting) != signature:
+                    continue
+                before = self.signature(filename)
+                self.write_snapshot(df, path)
+                os.remove(compacting)
+                _table_rebased(filename, before, self.signature(filename))
+
+def journal_path(path):
+    return path + ".journal"
+
+def compacting_path(path):
+    return path + ".journal.compacting"
+
+@st.cache_resource
+def _compactions_running():
+    return set()
+
+def _file_stat(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+def _read_csv_if_exists(path, columns=None):
+    try:
+        if columns is None:
+            return pd.read_csv(path)
+        header = _csv_header(path) or []
+        return pd.read_csv(path, usecols=[column for column in columns if column in header])
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return None
+
+def _dedupe_rows(df, filename):
+    key = table_key(filename)
+    if key in df.columns and df[key].duplicated().any():
+        # Journal rows win over older rows with the same key, but keep each
+        # key at the position where it first appeared
+        order = df[key].drop_duplicates()
+        df = df.drop_duplicates(key, keep="last").set_index(key).loc[order].reset_index()
+    return df
+
+def _write_file_atomic(path, write, mode="w", newline=None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode, newline=newline) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _csv_header(path):
     try:
-        return pd.read_csv(filename)
+        with open(path, newline="") as f:
+            return next(csv.reader(f), None)
     except FileNotFoundError:
-        return pd.DataFrame()
+        return None
+
+# Parquet Storage
+# ERP_STORAGE=parquet keeps a typed, columnar snapshot per table in
+# data/<table>.parquet (journals work as for CSV). Readers that pass
+# columns=[...] or date_range=(start, end) only decode those columns and
+# skip row groups outside the range. CSVs remain the import/export format:
+# `python erp_cinta.py migrate-parquet` and `python erp_cinta.py export-csv`.
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+
+class ParquetStorage(CsvStorage):
+    """Typed columnar snapshots with projection and predicate pushdown."""
+
+    indexed = True
+
+    def snapshot_path(self, filename):
+        return os.path.splitext(filename)[0] + ".parquet"
+
+    def read_snapshot(self, path, columns=None, where=None, date_column=None, date_range=None):
+        import pyarrow.parquet as pq
+        if not os.path.exists(path):
+            return None
+        available = self.snapshot_columns(path)
+        filters = []
+        for column, value in (where or {}).items():
+            if column in available:
+                filters.append((column, "in", list(value)) if isinstance(value, (list, tuple, set)) else (column, "==", value))
+        if date_range and date_column in available:
+            start, end = date_range
+            if start is not None:
+                filters.append((date_column, ">=", pd.Timestamp(start)))
+            if end is not None:
+                filters.append((date_column, "<", pd.Timestamp(end) + pd.Timedelta(days=1)))
+        table = pq.read_table(
+            path,
+            columns=None if columns is None else [column for column in columns if column in available],
+            filters=filters or None,
+        )
+        return table.to_pandas()
+
+    def write_snapshot(self, df, path):
+        filename = next((name for name in TABLE_SCHEMAS if self.snapshot_path(name) == path), None)
+        typed = _apply_schema(df.copy(), filename)
+        _write_file_atomic(path, lambda f: typed.to_parquet(f, index=False, row_group_size=PARQUET_ROW_GROUP_SIZE), mode="wb")
+
+    def snapshot_columns(self, path):
+        import pyarrow.parquet as pq
+        if not os.path.exists(path):
+            return None
+        return pq.read_schema(path).names
+
+    def read(self, filename, where=None, columns=None, date_range=None):
+        return _apply_schema(super().read(filename, where, columns, date_range), filename)
+
+def _apply_schema(df, filename):
+    # Journal rows come in as text; give every known column its fixed dtype
+    kinds = TABLE_SCHEMAS.get(filename, {}).get("columns", {})
+    for column in df.columns:
+        kind = kinds.get(column)
+        if kind == "date" and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+        elif kind == "integer" and df[column].dtype != "Int64":
+            df[column] = pd.to_numeric(df[column], errors="coerce").round().astype("Int64")
+        elif kind == "real" and df[column].dtype != "float64":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        elif kind == "category" and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+        elif kind == "text" and df[column].dtype != "string":
+            df[column] = df[column].astype("string")
+    return df
+
+# SQLite Storage
+class SqliteStorage:
+    """Tables in one SQLite database, with typed columns and indexes."""
+
+    indexed = True
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.ready = set()
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self.local.conn = conn
+        return conn
+
+    def ensure_table(self, conn, filename, columns=()):
+        table = table_name(filename)
+        schema = TABLE_SCHEMAS.get(filename, {"key": None, "columns": {}, "indexes": []})
+        if table not in self.ready:
+            definitions = [
+                f"{_quote(column)} {SQLITE_TYPES[kind]}" + (" PRIMARY KEY" if column == schema["key"] else "")
+                for column, kind in schema["columns"].items()
+            ] or [f"{_quote(column)} TEXT" for column in columns]
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(definitions)})")
+            for column in schema["indexes"]:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table}_{column}')} ON {_quote(table)} ({_quote(column)})")
+            self.ready.add(table)
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+        for column in columns:
+            if column not in existing:
+                # Columns outside the schema are kept as untyped text
+                conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)} TEXT")
+        return table
+
+    def signature(self, filename):
+        row = self.connect().execute("SELECT version FROM _versions WHERE name = ?", (table_name(filename),)).fetchone()
+        return ("sqlite", row[0] if row else 0)
+
+    def read(self, filename, where=None, columns=None, date_range=None):
+        conn = self.connect()
+        table = self.ensure_table(conn, filename)
+        selected = "*"
+        if columns is not None:
+            existing = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+            selected = ", ".join(_quote(column) for column in columns if column in existing)
+            if not selected:
+                return pd.DataFrame()
+        clause, params = _where_sql(where, TABLE_SCHEMAS.get(filename, {}).get("date_column"), date_range)
+        return pd.read_sql_query(f"SELECT {selected} FROM {_quote(table)}{clause} ORDER BY rowid", conn, params=params)
+
+    def read_page(self, filename, offset, limit, sort_by=None, ascending=True, where=None, search=None):
+        """LIMIT/OFFSET page of the table; filters and sorting run in SQLite."""
+        conn = self.connect()
+        table = self.ensure_table(conn, filename)
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")]
+        clause, params = _where_sql(where)
+        if search:
+            kinds = TABLE_SCHEMAS.get(filename, {}).get("columns", {})
+            text_columns = [column for column in existing if kinds.get(column, "text") in ("text", "category", "date")]
+            matches = " OR ".join(f"{_quote(column)} LIKE ?" for column in text_columns)
+            clause += (" AND " if clause else " WHERE ") + f"({matches})"
+            params += [f"%{search}%"] * len(text_columns)
+        total = conn.execute(f"SELECT COUNT(*) FROM {_quote(table)}{clause}", params).fetchone()[0]
+        order = " ORDER BY rowid"
+        if sort_by in existing:
+            order = f" ORDER BY {_quote(sort_by)} IS NULL, {_quote(sort_by)} {'ASC' if ascending else 'DESC'}, rowid"
+        page = pd.read_sql_query(f"SELECT * FROM {_quote(table)}{clause}{order} LIMIT ? OFFSET ?", conn, params=params + [limit, offset])
+        return page, total
+
+    def write(self, df, filename):
+        conn = self.connect()
+        with conn:
+            table = self.ensure_table(conn, filename, df.columns)
+            conn.execute(f"DELETE FROM {_quote(table)}")
+            self._insert(conn, table, filename, list(df.columns), _sql_values(df))
+            self._bump(conn, table)
+
+    def append(self, rows, filename):
+        """Insert (or update by key) rows in a single transaction."""
+        df = pd.DataFrame(rows)
+        conn = self.connect()
+        with conn:
+            table = self.ensure_table(conn, filename, df.columns)
+            self._insert(conn, table, filename, list(df.columns), _sql_values(df))
+            self._bump(conn, table)
+
+    def append_many(self, batches):
+        """Insert {filename: rows} into several tables in one transaction."""
+        conn = self.connect()
+        with conn:
+            for filename, rows in batches.items():
+                if not rows:
+                    continue
+                df = pd.DataFrame(rows)
+                table = self.ensure_table(conn, filename, df.columns)
+                self._insert(conn, table, filename, list(df.columns), _sql_values(df))
+                self._bump(conn, table)
+
+    def recover(self):
+        # SQLite's own write-ahead log makes multi-table writes atomic
+        return 0
+
+    def _insert(self, conn, table, filename, columns, values):
+        names = ", ".join(_quote(column) for column in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT INTO {_quote(table)} ({names}) VALUES ({placeholders})"
+        key = table_key(filename)
+        if key in columns:
+            updates = ", ".join(f"{_quote(column)} = excluded.{_quote(column)}" for column in columns if column != key)
+            sql += f" ON CONFLICT({_quote(key)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        conn.executemany(sql, values)
+
+    def _bump(self, conn, table):
+        conn.execute(
+            "INSERT INTO _versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (table,),
+        )
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _where_sql(where, date_column=None, date_range=None):
+    clauses, params = [], []
+    if date_range and date_column:
+        start, end = date_range
+        if start is not None:
+            clauses.append(f"{_quote(date_column)} >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+        if end is not None:
+            clauses.append(f"{_quote(date_column)} < ?")
+            params.append((pd.Timestamp(end) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+    for column, value in (where or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
+        else:
+            clauses.append(f"{_quote(column)} = ?")
+            params.append(value)
+    if not clauses:
+        return "", []
+    return " WHERE " + " AND ".join(clauses), params
+
+def _sql_values(df):
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+def import_csv_tables(storage):
+    """Copy every CSV table (snapshot + journal) into another backend."""
+    source = CsvStorage()
+    imported = {}
+    for filename in TABLE_SCHEMAS:
+        if source.signature(filename) == (None, None, None):
+            continue
+        df = source.read(filename)
+        storage.write(df, filename)
+        imported[filename] = len(df)
+    return imported
+
+def export_csv_tables(storage):
+    """Write every table of a backend back out as plain CSV."""
+    target = CsvStorage()
+    exported = {}
+    for filename in TABLE_SCHEMAS:
+        df = storage.read(filename)
+        if df.empty and not len(df.columns):
+            continue
+        target.write(df, filename)
+        exported[filename] = len(df)
+    return exported
+
+# Write Service
+# All table mutations from every session go through one writer thread.
+# Requests that arrive while a batch is being written are grouped by table
+# and committed together with a single append (one fsync / transaction), so
+# there are no lost read-modify-write updates, and IDs such as "S014" are
+# allocated atomically from a per-table sequence.
+#
+# With ERP_WRITE_BEHIND=1, submits don't wait for storage at all: IDs are
+# allocated on the caller's thread, the rows are appended (fsynced) to the
+# local WRITE_QUEUE_PATH and the call returns. A flusher thread coalesces
+# queued entries by table and key and commits them with commit_tables(),
+# then records the last flushed sequence number in WRITE_QUEUE_FLUSHED_PATH.
+# Entries after that number are replayed on startup; rows are keyed upserts
+# with IDs already assigned, so replaying an entry twice is harmless to the
+# tables. Views count appended rows, though, so the views of every table a
+# replayed entry touches are rebuilt from storage once it is committed.
+WRITE_BATCH_MAX = 500
+WRITE_TIMEOUT_SECONDS = 30
+WRITE_BEHIND = os.environ.get("ERP_WRITE_BEHIND", "0") not in ("", "0")
+WRITE_QUEUE_PATH = "data/write_queue.jsonl"
+WRITE_QUEUE_FLUSHED_PATH = "data/write_queue.flushed"
+WRITE_FLUSH_INTERVAL_SECONDS = 0.2
+WRITE_FLUSH_RETRY_SECONDS = 5
+
+class WriteService:
+    """Serializes table appends and allocates IDs for them."""
+
+    def __init__(self, write_behind=False):
+        self.requests = queue.Queue()
+        self.sequences = {}
+        # Guards sequences and the write-behind queue
+        self.lock = threading.RLock()
+        self.write_behind = write_behind
+        self.pending = {}
+        self.queued = threading.Event()
+        self.flush_error = None
+        self.flushed_seq = self.last_seq = self._read_flushed_seq()
+        self.replayed_seq = self.flushed_seq
+        self.thread = threading.Thread(target=self._run, name="erp-writer", daemon=True)
+        self.thread.start()
+        self._replay_queue()
+        if self.write_behind or self.pending:
+            self.flusher = threading.Thread(target=self._flush_loop, name="erp-flusher", daemon=True)
+            self.flusher.start()
+
+    def submit(self, filename, rows, id_column=None, id_prefix=None):
+        future = Future()
+        rows = [dict(row) for row in rows]
+        if not self.write_behind:
+            self.requests.put((filename, rows, id_column, id_prefix, future))
+            return future
+        try:
+            with self.lock:
+                for row in rows:
+                    if id_column and not row.get(id_column):
+                        row[id_column] = self._next_id(filename, id_column, id_prefix)
+                self._enqueue({filename: rows})
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(rows)
+        return future
+
+    def transact(self, prepare):
+        """Run prepare(next_id) on the writer thread and commit the
+        {filename: rows} it returns in one commit_tables() call."""
+        future = Future()
+        if not self.write_behind:
+            self.requests.put((None, prepare, None, None, future))
+            return future
+        try:
+            # Holding the lock orders prepare() after every queued entry
+            # (which load_current() sees) and before any later one
+            with self.lock:
+                batches = prepare(lambda filename, id_column, id_prefix: self._next_id(filename, id_column, id_prefix))
+                queued = {filename: rows for filename, rows in batches.items() if rows}
+                if queued:
+                    self._enqueue(queued)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(batches)
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            by_table = {}
+            for request in batch:
+                by_table.setdefault(request[0], []).append(request)
+            transactions = by_table.pop(None, [])
+            for filename, requests in by_table.items():
+                self._commit(filename, requests)
+            for _, prepare, _, _, future in transactions:
+                self._transact(prepare, future)
+
+    def _commit(self, filename, requests):
+        try:
+            rows = []
+            with self.lock:
+                for _, request_rows, id_column, id_prefix, _ in requests:
+                    for row in request_rows:
+                        if id_column and not row.get(id_column):
+                            row[id_column] = self._next_id(filename, id_column, id_prefix)
+                    rows.extend(request_rows)
+            append_to_csv(rows, filename)
+            self._sync_sequences(filename)
+        except Exception as exc:
+            # The batch is not written; forget sequences so they are rescanned
+            with self.lock:
+                self.sequences = {key: value for key, value in self.sequences.items() if key[0] != filename}
+            for request in requests:
+                request[4].set_exception(exc)
+        else:
+            for request in requests:
+                request[4].set_result(request[1])
+
+    def _transact(self, prepare, future):
+        try:
+            # Reads in prepare() see every earlier write and no later one
+            with _write_lock(), self.lock:
+                batches = prepare(lambda filename, id_column, id_prefix: self._next_id(filename, id_column, id_prefix))
+                commit_tables(batches)
+            for filename in batches:
+                self._sync_sequences(filename)
+        except Exception as exc:
+            with self.lock:
+                self.sequences = {}
+            future.set_exception(exc)
+        else:
+            future.set_result(batches)
+
+    def _next_id(self, filename, id_column, id_prefix):
+        key = (filename, id_column, id_prefix)
+        signature = _table_signature(filename)
+        if key not in self.sequences or self.sequences[key][0] != signature:
+            # First use, or the table was rewritten outside the service;
+            # IDs still in the write-behind queue are taken too
+            ids = load_from_csv(filename, columns=[id_column])
+            ids = ids[id_column] if id_column in ids.columns else pd.Series(dtype=str)
+            ids = pd.concat([ids, pd.Series([row.get(id_column) for row in self.pending_rows(filename)], dtype=object)])
+            numbers = pd.to_numeric(ids.astype(str).str.extract(rf"^{re.escape(id_prefix)}(\d+)$")[0], errors="coerce")
+            number = int(numbers.max()) + 1 if numbers.notna().any() else 1
+            if key in self.sequences:
+                # A flush landing between our checks must not hand out an ID twice
+                number = max(number, self.sequences[key][1])
+            self.sequences[key] = [signature, number]
+        number = self.sequences[key][1]
+        self.sequences[key][1] += 1
+        return f"{id_prefix}{number:03d}"
+
+    def _sync_sequences(self, filename):
+        # Our own append changed the signature; the counters are still right
+        signature = _table_signature(filename)
+        with self.lock:
+            for key, sequence in self.sequences.items():
+                if key[0] == filename:
+                    sequence[0] = signature
+
+    def pending_rows(self, filename):
+        """Rows for filename still waiting in the write-behind queue, oldest first."""
+        with self.lock:
+            return [row for entry in self.pending.values() for row in entry["tables"].get(filename, [])]
+
+    def status(self):
+        with self.lock:
+            oldest = min((entry["queued_at"] for entry in self.pending.values()), default=None)
+            return {
+                "depth": len(self.pending),
+                "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+                "flushed_seq": self.flushed_seq,
+                "error": self.flush_error,
+            }
+
+    def flush(self, timeout=WRITE_TIMEOUT_SECONDS):
+        """Wait until everything queued so far is in storage; False on timeout."""
+        target = self.last_seq
+        deadline = time.monotonic() + timeout
+        self.queued.set()
+        while self.flushed_seq < target:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _enqueue(self, tables):
+        # Caller holds self.lock, so sequence numbers follow queue file order
+        entry = {"seq": self.last_seq + 1, "queued_at": time.time(), "tables": tables}
+        with span("enqueue", ",".join(table_name(filename) for filename in tables)):
+            os.makedirs(os.path.dirname(WRITE_QUEUE_PATH) or ".", exist_ok=True)
+            with open(WRITE_QUEUE_PATH, "a") as f:
+                f.write(json.dumps(entry, default=lambda value: value.item() if hasattr(value, "item") else str(value)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self.last_seq = entry["seq"]
+        self.pending[entry["seq"]] = entry
+        self.queued.set()
+
+    def _read_flushed_seq(self):
+        try:
+            with open(WRITE_QUEUE_FLUSHED_PATH) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _replay_queue(self):
+        try:
+            with open(WRITE_QUEUE_PATH) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            if not line.endswith("\n"):
+                # Torn write: the submit never returned
+                continue
+            entry = json.loads(line)
+            self.last_seq = max(self.last_seq, entry["seq"])
+            if entry["seq"] > self.flushed_seq:
+                self.pending[entry["seq"]] = entry
+                self.replayed_seq = max(self.replayed_seq, entry["seq"])
+
+    def _flush_loop(self):
+        while True:
+            self.queued.wait(WRITE_FLUSH_INTERVAL_SECONDS)
+            self.queued.clear()
+            try:
+                self._flush_pending()
+            except Exception as exc:
+                # Entries stay queued (and on disk) until a flush succeeds
+                self.flush_error = f"{type(exc).__name__}: {exc}"
+                time.sleep(WRITE_FLUSH_RETRY_SECONDS)
+            else:
+                self.flush_error = None
+
+    def _flush_pending(self):
+        with self.lock:
+            entries = [self.pending[seq] for seq in sorted(self.pending)[:WRITE_BATCH_MAX]]
+        if not entries:
+            return
+        # Coalesce: one commit for the batch, later rows for a key win
+        batches = {}
+        for entry in entries:
+            for filename, rows in entry["tables"].items():
+                key = table_key(filename)
+                table = batches.setdefault(filename, {})
+                for row in rows:
+                    table[row.get(key) if key and row.get(key) else len(table)] = row
+        with span("flush") as timing:
+            timing.add(sum(len(rows) for rows in batches.values()))
+            commit_tables({filename: list(rows.values()) for filename, rows in batches.items()})
+        for filename in batches:
+            self._sync_sequences(filename)
+            if entries[0]["seq"] <= self.replayed_seq:
+                # These rows may have been committed before a crash
+                for view in _table_views(filename):
+                    view.invalidate()
+        last = entries[-1]["seq"]
+        _write_file_atomic(WRITE_QUEUE_FLUSHED_PATH, lambda f: f.write(str(last)))
+        with self.lock:
+            for entry in entries:
+                del self.pending[entry["seq"]]
+            self.flushed_seq = last
+            if not self.pending:
+                # Everything is in storage; start the queue file afresh
+                open(WRITE_QUEUE_PATH, "w").close()
+        if len(entries) == WRITE_BATCH_MAX:
+            self.queued.set()
+
+@st.cache_resource
+def _write_service():
+    return WriteService(WRITE_BEHIND)
+
+def write_rows(filename, rows, id_column=None, id_prefix=None):
+    """Append rows through the write service and return them with their IDs."""
+    return _write_service().submit(filename, rows, id_column, id_prefix).result(WRITE_TIMEOUT_SECONDS)
+
+def write_transaction(prepare):
+    """Commit the {filename: rows} built by prepare(next_id) atomically and return it;
+    next_id(filename, id_column, id_prefix) hands out IDs as write_rows does.
+    prepare() should read through load_current() to see queued writes."""
+    return _write_service().transact(prepare).result(WRITE_TIMEOUT_SECONDS)
+
+def load_current(filename, where=None):
+    """load_from_csv() plus rows still waiting in the write-behind queue."""
+    # Pending rows first: a flush between the two reads then shows up in storage
+    pending = _write_service().pending_rows(filename)
+    df = load_from_csv(filename, where=where)
+    if not pending:
+        return df
+    df = _dedupe_rows(pd.concat([df, pd.DataFrame(pending)], ignore_index=True), filename)
+    return _select_rows(df, filename, where).reset_index(drop=True)
+
+def write_queue_caption():
+    if not WRITE_BEHIND:
+        return
+    status = _write_service().status()
+    if status["error"]:
+        st.sidebar.error(f"Saving is retrying: {status['error']}")
+    elif status["depth"]:
+        st.sidebar.caption(f"{status['depth']} writes queued, oldest {status['lag_seconds']:.1f}s ago")
+
+# Bulk Import
+# Historical sales and stock counts are streamed from .csv / .xlsx uploads in
+# chunks of IMPORT_CHUNK_ROWS (Excel through openpyxl's read-only mode), so
+# memory stays bounded by the chunk size. Each chunk is validated with
+# vectorized checks and its valid rows are committed as one batch.
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_REJECTED_MAX = 10000
+
+IMPORT_RULES = {
+    "data/sales.csv": {
+        "required": ["Product Name", "Quantity Sold", "Total Price", "Sale Date", "Customer Name"],
+        "id": ("Sale ID", "S"),
+    },
+    "data/inventory.csv": {
+        "required": ["Product Name", "Stock Quantity", "Reorder Level", "Supplier"],
+        "id": ("Product ID", "P"),
+    },
+}
+
+def iter_import_chunks(uploaded, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Yield (chunk DataFrame, fraction of the file read) from a .csv or .xlsx upload."""
+    if uploaded.name.lower().endswith(".xlsx"):
+        import openpyxl
+        workbook = openpyxl.load_workbook(uploaded, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            rows = sheet.iter_rows(values_only=True)
+            header = [str(value).strip() if value is not None else "" for value in next(rows, [])]
+            total = max((sheet.max_row or 1) - 1, 1)
+            buffer, read = [], 0
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) == chunk_rows:
+                    read += len(buffer)
+                    yield pd.DataFrame(buffer, columns=header, dtype=object), min(read / total, 1.0)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=header, dtype=object), 1.0
+        finally:
+            workbook.close()
+    else:
+        size = getattr(uploaded, "size", 0) or 1
+        for chunk in pd.read_csv(uploaded, chunksize=chunk_rows, dtype=str, skipinitialspace=True):
+            chunk.columns = [str(column).strip() for column in chunk.columns]
+            yield chunk, min(uploaded.tell() / size, 1.0)
+
+def validate_import_chunk(chunk, filename):
+    """Split a chunk into (valid rows in table format, rejected rows with a Reason)."""
+    kinds = TABLE_SCHEMAS[filename]["columns"]
+    rules = IMPORT_RULES[filename]
+    df = pd.DataFrame(index=chunk.index)
+    reasons = pd.Series("", index=chunk.index)
+
+    def reject(mask, reason):
+        nonlocal reasons
+        reasons = reasons.where(~mask, reasons + reason + "; ")
+
+    for column, kind in kinds.items():
+        if column not in chunk.columns:
+            continue
+        raw = chunk[column]
+        blank = raw.isna() | raw.astype(str).str.strip().isin(["", "nan", "None"])
+        if kind in ("integer", "real"):
+            values = pd.to_numeric(raw, errors="coerce")
+            reject(~blank & values.isna(), f"{column} is not a number")
+            reject(values < 0, f"{column} is negative")
+            df[column] = values.round().astype("Int64") if kind == "integer" else values
+        elif kind == "date":
+            values = pd.to_datetime(raw, errors="coerce")
+            reject(~blank & values.isna(), f"{column} is not a date")
+            df[column] = values.dt.strftime("%Y-%m-%d")
+        else:
+            df[column] = raw.where(~blank).astype(object).str.strip() if pd.api.types.is_string_dtype(raw) else raw.where(~blank)
+        if column in rules["required"]:
+            reject(blank, f"{column} is required")
+    if filename == "data/sales.csv":
+        reject(df["Quantity Sold"] < 1, "Quantity Sold must be at least 1")
+    if filename == "data/inventory.csv":
+        reject(df["Reorder Level"] >= df["Stock Quantity"], "Reorder Level must be less than Stock Quantity")
+    bad = reasons != ""
+    rejected = chunk[bad].assign(Reason=reasons[bad].str.rstrip("; "))
+    return df[~bad], rejected
+
+def import_table(uploaded, filename, on_progress=None):
+    """Stream an upload into a table; returns (imported rows, rejected count, rejected sample)."""
+    rules = IMPORT_RULES[filename]
+    id_column, id_prefix = rules["id"]
+    imported, rejected_count, rejected = 0, 0, []
+    product_ids = None
+    claimed = set()
+    for chunk, fraction in iter_import_chunks(uploaded):
+        missing = [column for column in rules["required"] if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        valid, bad = validate_import_chunk(chunk, filename)
+        rejected_count += len(bad)
+        if len(bad) and sum(len(frame) for frame in rejected) < IMPORT_REJECTED_MAX:
+            rejected.append(bad)
+        if not valid.empty:
+            # Imports only add rows: IDs from another system (or branch) would
+            # overwrite our rows with the same IDs, so every row gets a new one
+            valid = valid.drop(columns=[id_column], errors="ignore")
+            if filename == "data/sales.csv" and "Product ID" not in valid.columns:
+                if product_ids is None:
+                    inventory = load_from_csv("data/inventory.csv", columns=["Product ID", "Product Name"])
+                    product_ids = inventory.drop_duplicates("Product Name").set_index("Product Name")["Product ID"] if not inventory.empty else pd.Series(dtype=object)
+                valid = valid.assign(**{"Product ID": valid["Product Name"].map(product_ids).fillna("")})
+            if filename == "data/inventory.csv":
+                # Given codes must be free and appear once in the upload; blank ones get a new code
+                index = get_barcode_index()
+                barcodes = valid["Barcode"] if "Barcode" in valid.columns else pd.Series(None, index=valid.index, dtype=object)
+                reasons = {}
+                for row, code in zip(valid.index, barcodes):
+                    if not (isinstance(code, str) and code):
+                        continue
+                    if code in claimed:
+                        reasons[row] = "Barcode appears more than once in the file"
+                    elif index.in_use(code):
+                        reasons[row] = "Barcode is already used by another item"
+                    else:
+                        claimed.add(code)
+                if reasons:
+                    bad = chunk.loc[list(reasons)].assign(Reason=pd.Series(reasons))
+                    rejected_count += len(bad)
+                    if sum(len(frame) for frame in rejected) < IMPORT_REJECTED_MAX:
+                        rejected.append(bad)
+                    valid, barcodes = valid.drop(index=list(reasons)), barcodes.drop(index=list(reasons))
+                valid = valid.assign(Barcode=[code if isinstance(code, str) and code else index.new_barcode() for code in barcodes])
+            rows = [{column: value for column, value in row.items() if not pd.isna(value)} for row in valid.to_dict("records")]
+            if rows:
+                write_rows(filename, rows, id_column=id_column, id_prefix=id_prefix)
+            imported += len(rows)
+        if on_progress:
+            on_progress(fraction, imported, rejected_count)
+    sample = pd.concat(rejected).head(IMPORT_REJECTED_MAX) if rejected else pd.DataFrame()
+    return imported, rejected_count, sample
+
+def bulk_import_page(filename, label):
+    st.subheader(f"Bulk Import {label}")
+    rules = IMPORT_RULES[filename]
+    st.write(
+        f"Upload a .csv or .xlsx file whose first row holds the column names. "
+        f"Required: {', '.join(rules['required'])}. Other columns: "
+        f"{', '.join(column for column in TABLE_SCHEMAS[filename]['columns'] if column not in rules['required'] and column != rules['id'][0])}. "
+        f"Every row is added with a new {rules['id'][0]}."
+    )
+    uploaded = st.file_uploader("Upload File", type=["csv", "xlsx"], key=f"import_{table_name(filename)}")
+    if uploaded is not None and st.button("Start Import", key=f"import_{table_name(filename)}_start"):
+        progress = st.progress(0.0, text="Importing...")
+        started = time.perf_counter()
+
+        def on_progress(fraction, imported, rejected_count):
+            progress.progress(fraction, text=f"{imported:,} rows imported, {rejected_count:,} rejected")
+
+        try:
+            imported, rejected_count, rejected = import_table(uploaded, filename, on_progress)
+        except ValueError as exc:
+            st.error(str(exc))
+            return
+        elapsed = time.perf_counter() - started
+        progress.progress(1.0, text="Import complete.")
+        st.success(f"Imported {imported:,} rows in {elapsed:,.1f}s ({imported / max(elapsed, 1e-9):,.0f} rows/s).")
+        if rejected_count:
+            st.warning(f"{rejected_count:,} rows were rejected.")
+            st.dataframe(rejected.head(100))
+            st.download_button("Download Rejected Rows", rejected.to_csv(index=False), f"rejected_{table_name(filename)}.csv", "text/csv")
+
+# Reorder Alerts
+# Inventory is scanned once, vectorized, for items at or below their reorder
+# level; after that every stock change (sale, restock, import) arrives as an
+# upserted inventory row and only moves that item in or out of the at-risk
+# set. Alerts are ranked by days of cover: stock over the average units sold
+# per day across the last REORDER_VELOCITY_DAYS.
+REORDER_VELOCITY_DAYS = 28
+REORDER_COVER_DAYS = 14
+
+class SalesVelocity(TableView):
+    """Units sold per product per day over the recent sales window."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        # {Product ID (or name when the sale has no ID): {day: units}}
+        self.daily = {}
+
+    def update(self, df):
+        if "Sale Date" not in df.columns or "Quantity Sold" not in df.columns:
+            return
+        days = pd.to_datetime(df["Sale Date"], errors="coerce").dt.date
+        ids = df["Product ID"] if "Product ID" in df.columns else pd.Series(None, index=df.index, dtype=object)
+        names = df["Product Name"] if "Product Name" in df.columns else pd.Series(None, index=df.index, dtype=object)
+        frame = pd.DataFrame({
+            "product": ids.where(ids.notna() & (ids.astype(str) != ""), names),
+            "day": days,
+            "units": pd.to_numeric(df["Quantity Sold"], errors="coerce").fillna(0),
+        }).dropna(subset=["product", "day"])
+        frame = frame[frame["day"] >= date.today() - timedelta(days=REORDER_VELOCITY_DAYS)]
+        for (product, day), units in frame.groupby(["product", "day"], sort=False)["units"].sum().items():
+            daily = self.daily.setdefault(product, {})
+            daily[day] = daily.get(day, 0) + float(units)
+
+    def per_day(self, product_id, name=None):
+        start = date.today() - timedelta(days=REORDER_VELOCITY_DAYS)
+        with self.lock:
+            units = 0.0
+            for product in (product_id, name):
+                daily = self.daily.get(product)
+                if daily:
+                    # Forget days that have slid out of the window
+                    for day in [day for day in daily if day < start]:
+                        del daily[day]
+                    units += sum(daily.values())
+        return units / REORDER_VELOCITY_DAYS
+
+@st.cache_resource
+def _sales_velocity():
+    return SalesVelocity()
+
+register_view("data/sales.csv", _sales_velocity)
+
+def get_sales_velocity():
+    return _sales_velocity().refresh()
+
+class ReorderEngine(TableView):
+    """Inventory items at or below their reorder level."""
+
+    filename = "data/inventory.csv"
+
+    def reset(self):
+        # {Product ID: (Product Name, Stock Quantity, Reorder Level, Supplier)}
+        self.items = {}
+        self.at_risk = set()
+
+    def update(self, df):
+        if "Product ID" not in df.columns:
+            return
+        stock = pd.to_numeric(df.get("Stock Quantity"), errors="coerce")
+        reorder = pd.to_numeric(df.get("Reorder Level"), errors="coerce")
+        risky = (stock <= reorder).to_numpy()
+        ids = df["Product ID"].to_numpy()
+        names = df["Product Name"] if "Product Name" in df.columns else pd.Series(None, index=df.index)
+        suppliers = df["Supplier"] if "Supplier" in df.columns else pd.Series(None, index=df.index)
+        self.items.update(zip(ids, zip(names, stock, reorder, suppliers)))
+        self.at_risk.difference_update(ids[~risky])
+        self.at_risk.update(ids[risky])
+
+    def alerts(self, velocity):
+        """At-risk items as a DataFrame, fewest days of cover first."""
+        with self.lock:
+            items = [(product_id, *self.items[product_id]) for product_id in self.at_risk]
+        df = pd.DataFrame(items, columns=["Product ID", "Product Name", "Stock Quantity", "Reorder Level", "Supplier"])
+        per_day = np.array([velocity.per_day(product_id, name) for product_id, name in zip(df["Product ID"], df["Product Name"])], dtype=float)
+        stock = df["Stock Quantity"].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Items already out of stock have no cover, however slow they sell
+            cover = np.where(stock <= 0, 0.0, np.where(per_day > 0, stock / per_day, np.inf))
+        df["Units/Day"] = per_day.round(2)
+        df["Days of Cover"] = cover.round(1)
+        # Enough to get back above the reorder level with REORDER_COVER_DAYS of demand on top
+        df["Suggested Order"] = np.ceil(df["Reorder Level"].to_numpy(dtype=float) + per_day * REORDER_COVER_DAYS - stock + 1).clip(min=1)
+        return df.sort_values(["Days of Cover", "Stock Quantity"], kind="stable").reset_index(drop=True)
+
+@st.cache_resource
+def _reorder_engine():
+    return ReorderEngine()
+
+register_view("data/inventory.csv", _reorder_engine)
+
+def get_reorder_engine():
+    return _reorder_engine().refresh()
+
+def adjust_stock(product_id, delta, restocked=None):
+    """Add delta to an item's Stock Quantity; returns the updated row or None."""
+    inventory_file = "data/inventory.csv"
+
+    # Read-modify-write on the writer thread so concurrent tills don't lose
+    # each other's decrements; the row goes to the journal as an upsert
+    def prepare(next_id):
+        match = load_current(inventory_file, where={"Product ID": product_id})
+        if match.empty:
+            return {}
+        row, = plain_rows(match.iloc[:1])
+        row["Stock Quantity"] = int(pd.to_numeric(row.get("Stock Quantity"), errors="coerce") or 0) + int(delta)
+        if restocked is not None:
+            row["Last Restocked"] = restocked.strftime("%Y-%m-%d")
+        return {inventory_file: [row]}
+
+    rows = write_transaction(prepare).get(inventory_file)
+    return rows[0] if rows else None
+
+# Expiry Index
+# Every inventory row is a lot. Lots with stock on hand are kept in a list
+# sorted by (expiry day, Product ID), overall and per product name, so
+# "expiring within N days" is two bisects and a slice and the POS can pick
+# the first-expiring lot (FEFO) without touching the rest of the catalog.
+DAY_EPOCH = pd.Timestamp("1970-01-01")
+
+def _epoch_day(day):
+    return (pd.Timestamp(day) - DAY_EPOCH).days
+
+class ExpiryIndex(TableView):
+    """Lots in stock ordered by expiration date."""
+
+    filename = "data/inventory.csv"
+
+    def reset(self):
+        # {Product ID: (expiry day, Product Name, Stock Quantity, Unit Price)}
+        self.lots = {}
+        self.order = []
+        self.by_name = {}
+
+    def update(self, df):
+        if "Product ID" not in df.columns or "Expiration Date" not in df.columns:
+            return
+        days = (pd.to_datetime(df["Expiration Date"], errors="coerce") - DAY_EPOCH).dt.days
+        stock = pd.to_numeric(df.get("Stock Quantity"), errors="coerce").fillna(0)
+        prices = pd.to_numeric(df["Unit Price"], errors="coerce") if "Unit Price" in df.columns else pd.Series(float("nan"), index=df.index)
+        names = df["Product Name"] if "Product Name" in df.columns else pd.Series(None, index=df.index)
+        lots = zip(df["Product ID"], days, names, stock, prices)
+        if not self.lots:
+            # First build: one sort instead of an insort per lot
+            for product_id, day, name, units, price in lots:
+                self.lots[product_id] = self._lot(day, name, units, price)
+            entries = sorted((lot[0], product_id) for product_id, lot in self.lots.items() if self._indexed(lot))
+            self.order = entries
+            for day, product_id in entries:
+                self.by_name.setdefault(self.lots[product_id][1], []).append((day, product_id))
+            return
+        for product_id, day, name, units, price in lots:
+            self._remove(product_id)
+            lot = self._lot(day, name, units, price)
+            self.lots[product_id] = lot
+            if self._indexed(lot):
+                bisect.insort(self.order, (lot[0], product_id))
+                bisect.insort(self.by_name.setdefault(name, []), (lot[0], product_id))
+
+    @staticmethod
+    def _lot(day, name, units, price):
+        return (None if pd.isna(day) else int(day), name, float(units), None if pd.isna(price) else float(price))
+
+    @staticmethod
+    def _indexed(lot):
+        return lot[0] is not None and lot[2] > 0
+
+    def _remove(self, product_id):
+        lot = self.lots.get(product_id)
+        if lot is None or not self._indexed(lot):
+            return
+        entry = (lot[0], product_id)
+        for entries in (self.order, self.by_name.get(lot[1], [])):
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    def _lot_rows(self, entries):
+        rows = []
+        for day, product_id in entries:
+            _, name, units, price = self.lots[product_id]
+            rows.append({
+                "Product ID": product_id,
+                "Product Name": name,
+                "Expiration Date": (DAY_EPOCH + pd.Timedelta(days=day)).date(),
+                "Stock Quantity": units,
+                "Unit Price": price,
+            })
+        return pd.DataFrame(rows, columns=["Product ID", "Product Name", "Expiration Date", "Stock Quantity", "Unit Price"])
+
+    def expiring(self, days, today=None):
+        """Lots in stock expiring from today through today + days, soonest first."""
+        start = _epoch_day(today or date.today())
+        with self.lock:
+            lo = bisect.bisect_left(self.order, (start,))
+            hi = bisect.bisect_left(self.order, (start + days + 1,))
+            return self._lot_rows(self.order[lo:hi])
+
+    def expired(self, today=None):
+        """Lots still in stock whose expiration date has passed."""
+        with self.lock:
+            hi = bisect.bisect_left(self.order, (_epoch_day(today or date.today()),))
+            return self._lot_rows(self.order[:hi])
+
+    def fefo(self, name, quantity, today=None, pending=()):
+        """([(Product ID, units)], units short) taking quantity from the stock of unexpired lots
+        of name, first-expiring first; no lot is taken below zero.
+        pending holds inventory rows not yet in storage (oldest first); they replace the indexed lots."""
+        allocation = []
+        queued = {}
+        for row in pending:
+            day = (pd.to_datetime(row.get("Expiration Date"), errors="coerce") - DAY_EPOCH).days
+            units = pd.to_numeric(row.get("Stock Quantity"), errors="coerce")
+            price = pd.to_numeric(row.get("Unit Price"), errors="coerce")
+            queued[row["Product ID"]] = self._lot(day, row.get("Product Name"), 0 if pd.isna(units) else units, price)
+        with self.lock:
+            entries = self.by_name.get(name, [])
+            if queued:
+                entries = sorted([entry for entry in entries if entry[1] not in queued] + [(lot[0], product_id) for product_id, lot in queued.items() if lot[1] == name and self._indexed(lot)])
+            i = bisect.bisect_left(entries, (_epoch_day(today or date.today()),))
+            for _, product_id in entries[i:]:
+                if quantity <= 0:
+                    break
+                take = min(quantity, int((queued.get(product_id) or self.lots[product_id])[2]))
+                if take > 0:
+                    allocation.append((product_id, take))
+                    quantity -= take
+        return allocation, max(quantity, 0)
+
+    def unit_price(self, product_id):
+        lot = self.lots.get(product_id)
+        return lot[3] if lot else None
+
+@st.cache_resource
+def _expiry_index():
+    return ExpiryIndex()
+
+register_view("data/inventory.csv", _expiry_index)
+
+def get_expiry_index():
+    return _expiry_index().refresh()
+
+# Product Search
+# Suggestions for product fields come from an index kept in step with the
+# inventory, not a scan. Names, IDs and barcodes sit in one sorted list, so
+# a prefix lookup is a bisect plus a short walk. Names and suppliers are
+# also split into words, each with the set of items using it: a query
+# matches items having every query word, the last one (still being typed)
+# as a prefix, and typos are caught by comparing query words with the
+# vocabulary words that share their trigrams.
+SEARCH_FIELDS = {"Product ID": 1.0, "Product Name": 1.0, "Barcode": 1.0, "Supplier": 0.5}
+SEARCH_KEY_FIELDS = ["Product ID", "Product Name", "Barcode"]
+SEARCH_WORD_FIELDS = ["Product Name", "Supplier"]
+SEARCH_SCAN_MAX = 500
+SEARCH_MIN_SIMILARITY = 0.3
+SEARCH_PREFIX_SIMILARITY = 0.9
+_SEARCH_WORD = re.compile(r"[0-9a-z]+")
+
+def _search_text(value):
+    return " ".join(str(value).lower().split()) if not pd.isna(value) else ""
+
+def _search_words(text):
+    return _SEARCH_WORD.findall(text)
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _one_edit_apart(a, b):
+    # One substitution, insertion, deletion or swap of neighbours; short
+    # words share too few trigrams to be matched on those alone
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+    return a[i:] == b[i + 1:] if len(a) < len(b) else a[i + 1:] == b[i:]
+
+class ProductSearch(TableView):
+    """Prefix and fuzzy lookup over inventory names, IDs, suppliers and barcodes."""
+
+    filename = "data/inventory.csv"
+
+    def reset(self):
+        # {Product ID: (value per SEARCH_FIELDS)}
+        self.records = {}
+        # Sorted (key, Product ID, field weight) for SEARCH_KEY_FIELDS values
+        self.prefixes = []
+        # {field: {word: {Product ID}}}, plus the sorted vocabulary and
+        # {trigram: {word}} over its alphabetic words
+        self.words = {field: {} for field in SEARCH_WORD_FIELDS}
+        self.vocabulary = []
+        self.trigrams = {}
+
+    def update(self, df):
+        if "Product ID" not in df.columns:
+            return
+        columns = [df[field].astype(object).where(df[field].notna(), None).tolist() if field in df.columns else [None] * len(df) for field in SEARCH_FIELDS]
+        records = list(zip(*columns))
+        if not self.records:
+            self._build(records)
+            return
+        for record in records:
+            self._remove(record[0])
+            self._add(record)
+
+    def _build(self, records):
+        # First build: one sort and no per-word insorts, which matters with
+        # hundreds of thousands of items
+        self.records = {record[0]: record for record in records}
+        fields = list(SEARCH_FIELDS)
+        entries = []
+        for field in SEARCH_KEY_FIELDS:
+            i, weight = fields.index(field), SEARCH_FIELDS[field]
+            entries.extend((_search_text(record[i]), record[0], weight) for record in self.records.values() if record[i] is not None)
+        self.prefixes = sorted(entries)
+        for field in SEARCH_WORD_FIELDS:
+            i, postings, split = fields.index(field), self.words[field], {}
+            for record in self.records.values():
+                value = record[i]
+                if value not in split:
+                    # Suppliers repeat, so each distinct value is split once
+                    split[value] = set(_search_words(_search_text(value))) if value is not None else ()
+                for word in split[value]:
+                    items = postings.get(word)
+                    if items is None:
+                        items = postings[word] = set()
+                    items.add(record[0])
+        self.vocabulary = sorted({word for postings in self.words.values() for word in postings})
+        for word in self.vocabulary:
+            self._index_trigrams(word)
+
+    def _keys(self, record):
+        fields = list(SEARCH_FIELDS)
+        return [(_search_text(record[fields.index(field)]), record[0], SEARCH_FIELDS[field]) for field in SEARCH_KEY_FIELDS if record[fields.index(field)] is not None]
+
+    def _record_words(self, record):
+        fields = list(SEARCH_FIELDS)
+        return [(field, set(_search_words(_search_text(record[fields.index(field)])))) for field in SEARCH_WORD_FIELDS if record[fields.index(field)] is not None]
+
+    def _index_trigrams(self, word):
+        if word.isalpha():
+            for gram in _trigrams(word):
+                self.trigrams.setdefault(gram, set()).add(word)
+
+    def _add(self, record):
+        self.records[record[0]] = record
+        for entry in self._keys(record):
+            bisect.insort(self.prefixes, entry)
+        for field, words in self._record_words(record):
+            for word in words:
+                if word not in self.words[field]:
+                    self.words[field][word] = set()
+                    i = bisect.bisect_left(self.vocabulary, word)
+                    if i == len(self.vocabulary) or self.vocabulary[i] != word:
+                        self.vocabulary.insert(i, word)
+                        self._index_trigrams(word)
+                self.words[field][word].add(record[0])
+
+    def _remove(self, product_id):
+        # Words left without items stay in the vocabulary; lookups skip them
+        record = self.records.pop(product_id, None)
+        if record is None:
+            return
+        for entry in self._keys(record):
+            i = bisect.bisect_left(self.prefixes, entry)
+            if i < len(self.prefixes) and self.prefixes[i] == entry:
+                del self.prefixes[i]
+        for field, words in self._record_words(record):
+            for word in words:
+                items = self.words[field].get(word)
+                if items is not None:
+                    items.discard(product_id)
+                    if not items:
+                        del self.words[field][word]
+
+    def _similar_words(self, word, prefix=False):
+        """{vocabulary word: similarity} for words equal or close to word, and
+        with prefix=True also the words starting with it."""
+        similar = {}
+        if prefix:
+            i = bisect.bisect_left(self.vocabulary, word)
+            for candidate in self.vocabulary[i:i + SEARCH_SCAN_MAX]:
+                if not candidate.startswith(word):
+                    break
+                similar[candidate] = SEARCH_PREFIX_SIMILARITY
+        if word.isalpha():
+            grams = _trigrams(word)
+            shared = {}
+            for gram in grams:
+                for candidate in self.trigrams.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            for candidate, count in shared.items():
+                similarity = count / (len(grams) + len(candidate) + 1 - count)
+                if similarity < SEARCH_MIN_SIMILARITY and _one_edit_apart(word, candidate):
+                    similarity = SEARCH_MIN_SIMILARITY
+                if similarity >= SEARCH_MIN_SIMILARITY and similarity > similar.get(candidate, 0):
+                    similar[candidate] = similarity
+        similar[word] = 1.0
+        return similar
+
+    def _word_matches(self, words, limit):
+        """{Product ID: score} for items matching every query word."""
+        per_word = []
+        for n, word in enumerate(words):
+            similar = self._similar_words(word, prefix=n == len(words) - 1)
+            scored = sorted(
+                ((similarity * SEARCH_FIELDS[field], self.words[field][candidate])
+                 for candidate, similarity in similar.items()
+                 for field in SEARCH_WORD_FIELDS if candidate in self.words[field]),
+                key=lambda item: item[0],
+            )
+            if not scored:
+                return {}
+            per_word.append(scored)
+        # Items matching each word at its best score outrank all others; when
+        # there are enough of them no item needs scoring
+        tops = [scored[-1][0] for scored in per_word]
+        tiers = []
+        for scored, top in zip(per_word, tops):
+            sets = [items for score, items in scored if score == top]
+            tiers.append(sets[0] if len(sets) == 1 else set().union(*sets))
+        tiers.sort(key=len)
+        common = tiers[0].intersection(*tiers[1:])
+        if len(common) >= limit:
+            return dict.fromkeys(itertools.islice(common, limit), sum(tops) / len(tops))
+        best_per_word = []
+        for scored in per_word:
+            # Best score per item: apply weakest first so stronger ones overwrite
+            best = {}
+            for score, items in scored:
+                best.update(dict.fromkeys(items, score))
+            best_per_word.append(best)
+        best_per_word.sort(key=len)
+        common = best_per_word[0].keys()
+        for best in best_per_word[1:]:
+            common = common & best.keys()
+        return {product_id: sum(best[product_id] for best in best_per_word) / len(best_per_word) for product_id in common}
+
+    def search(self, query, limit=10):
+        """Up to limit items best matching query, best first, with a Score column."""
+        text = _search_text(query)
+        columns = list(SEARCH_FIELDS) + ["Score"]
+        if not text:
+            return pd.DataFrame(columns=columns)
+        with self.lock:
+            # Whole-value prefix matches score above 1, word matches up to 1
+            scores = {}
+            i = bisect.bisect_left(self.prefixes, (text,))
+            for key, product_id, weight in self.prefixes[i:i + SEARCH_SCAN_MAX]:
+                if not key.startswith(text):
+                    break
+                scores[product_id] = max(scores.get(product_id, 0), 1 + weight + (key == text))
+            if len(scores) < limit:
+                words = _search_words(text)
+                for product_id, score in (self._word_matches(words, limit) if words else {}).items():
+                    if score > scores.get(product_id, 0):
+                        scores[product_id] = score
+            # Ties keep the order found: prefix matches in key order
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            rows = [(*self.records[product_id], round(score, 3)) for product_id, score in best]
+        return pd.DataFrame(rows, columns=columns)
+
+    def names(self, query, limit=10):
+        """Distinct product names best matching query."""
+        return list(dict.fromkeys(self.search(query, limit * 3)["Product Name"].dropna()))[:limit]
+
+    def exact_name(self, name):
+        """The stored spelling of name, compared ignoring case and spacing, or None."""
+        text = _search_text(name)
+        with self.lock:
+            i = bisect.bisect_left(self.prefixes, (text,))
+            for key, product_id, weight in self.prefixes[i:i + SEARCH_SCAN_MAX]:
+                if key != text:
+                    break
+                name = self.records[product_id][list(SEARCH_FIELDS).index("Product Name")]
+                if _search_text(name) == text:
+                    return name
+        return None
+
+@st.cache_resource
+def _product_search():
+    return ProductSearch()
+
+register_view("data/inventory.csv", _product_search)
+
+def get_product_search():
+    return _product_search().refresh()
+
+# Basket Checkout
+# The POS collects lines in the session and commits the basket as one
+# transaction on the writer thread: a sale row per line, the new stock of
+# every lot it draws from (FEFO for lines entered by name) and one revenue
+# entry for the basket total.
+def basket_line(product_id, product_name, quantity, unit_price):
+    return {"Product ID": product_id or "", "Product Name": product_name, "Quantity Sold": int(quantity), "Unit Price": float(unit_price)}
+
+def add_to_basket(basket, line):
+    # Scanning the same item again adds to its line
+    for existing in basket:
+        if (existing["Product ID"], existing["Product Name"], existing["Unit Price"]) == (line["Product ID"], line["Product Name"], line["Unit Price"]):
+            existing["Quantity Sold"] += line["Quantity Sold"]
+            return
+    basket.append(line)
+
+def checkout_basket(basket, customer_name, payment_method, sale_date):
+    """Commit the basket; returns {filename: rows written}."""
+    sales_file = "data/sales.csv"
+    inventory_file = "data/inventory.csv"
+    financial_file = "data/financial.csv"
+    day = sale_date.strftime("%Y-%m-%d")
+
+    def prepare(next_id):
+        expiry = get_expiry_index()
+        # In write-behind mode the index only sees flushed stock; queued rows override it
+        pending = _write_service().pending_rows(inventory_file)
+        sales, taken = [], {}
+        for line in basket:
+            quantity = line["Quantity Sold"]
+            if line["Product ID"]:
+                lots = [(line["Product ID"], quantity)]
+            else:
+                lots, short = expiry.fefo(line["Product Name"], quantity, pending=pending)
+                if lots and short:
+                    raise ValueError(f"Only {quantity - short} {line['Product Name']} in stock and in date; {quantity} asked for.")
+                if not lots:
+                    # No dated lot in stock; link to any item with this name
+                    match = load_current(inventory_file, where={"Product Name": line["Product Name"]})
+                    lots = [(match.iloc[0]["Product ID"], quantity)] if not match.empty else []
+            for product_id, units in lots:
+                taken[product_id] = taken.get(product_id, 0) + units
+            # One sale per lot drawn, so each lot's sales are credited to it;
+            # products not in the inventory are sold without a Product ID
+            for product_id, units in lots or [("", quantity)]:
+                sales.append({
+                    "Sale ID": next_id(sales_file, "Sale ID", "S"),
+                    "Product ID": product_id,
+                    "Product Name": line["Product Name"],
+                    "Quantity Sold": units,
+                    "Total Price": round(units * line["Unit Price"], 2),
+                    "Sale Date": day,
+                    "Customer Name": customer_name,
+                    "Payment Method": payment_method,
+                })
+        inventory, short = [], []
+        if taken:
+            for row in plain_rows(load_current(inventory_file, where={"Product ID": list(taken)})):
+                stock = int(row.get("Stock Quantity", 0))
+                if taken[row["Product ID"]] > stock:
+                    short.append(f"{row['Product Name']} ({row['Product ID']}: {stock} in stock, {taken[row['Product ID']]} asked for)")
+                row["Stock Quantity"] = stock - taken[row["Product ID"]]
+                inventory.append(row)
+        if short:
+            raise ValueError(f"Not enough stock of {', '.join(short)}.")
+        revenue = {
+            "Transaction ID": next_id(financial_file, "Transaction ID", "T"),
+            "Description": f"POS sale {sales[0]['Sale ID']}" + (f"–{sales[-1]['Sale ID']}" if len(sales) > 1 else "") + f" to {customer_name}",
+            "Amount": round(sum(row["Total Price"] for row in sales), 2),
+            "Type": "Revenue",
+            "Date": day,
+        }
+        return {sales_file: sales, inventory_file: inventory, financial_file: [revenue]}
+
+    return write_transaction(prepare)
+
+# Payroll
+# A run computes every payslip for a pay period as whole-column numpy
+# operations and appends the batch in a single write. Payslips are never
+# rewritten: re-running a period only adds payslips for employees whose
+# inputs (name, salary, attendance, statutory rules) hash differently from
+# their latest payslip for that period, and the latest payslip wins.
+# Statutory rates are monthly, per the Kenyan schedules in force from 2025.
+PAYROLL_RULES = "KE-2025-02"  # change when rates change so every payslip is recomputed
+PAYE_BANDS = [(24000, 0.10), (32333, 0.25), (500000, 0.30), (800000, 0.325), (float("inf"), 0.35)]
+PERSONAL_RELIEF = 2400
+NSSF_RATE = 0.06
+NSSF_UPPER_EARNINGS_LIMIT = 72000
+SHIF_RATE = 0.0275
+SHIF_MINIMUM = 300
+HOUSING_LEVY_RATE = 0.015
+
+def compute_payroll(employees):
+    """Payslip amounts for a frame with Salary (monthly) and Attendance (%)."""
+    salary = pd.to_numeric(employees["Salary"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    attendance = pd.to_numeric(employees["Attendance"], errors="coerce").fillna(100).clip(0, 100).to_numpy(dtype=float)
+    gross = salary * attendance / 100
+    nssf = NSSF_RATE * np.minimum(gross, NSSF_UPPER_EARNINGS_LIMIT)
+    shif = np.where(gross > 0, np.maximum(SHIF_RATE * gross, SHIF_MINIMUM), 0)
+    housing = HOUSING_LEVY_RATE * gross
+    # NSSF, SHIF and the housing levy are deducted before PAYE
+    taxable = np.maximum(gross - nssf - shif - housing, 0)
+    tax = np.zeros_like(taxable)
+    lower = 0.0
+    for upper, rate in PAYE_BANDS:
+        tax += rate * np.clip(taxable - lower, 0, upper - lower)
+        lower = upper
+    paye = np.maximum(tax - PERSONAL_RELIEF, 0)
+    deductions = nssf + shif + housing + paye
+    return pd.DataFrame({
+        "Salary": salary,
+        "Attendance": attendance,
+        "Gross Pay": gross,
+        "NSSF": nssf,
+        "SHIF": shif,
+        "Housing Levy": housing,
+        "Taxable Pay": taxable,
+        "PAYE": paye,
+        "Total Deductions": deductions,
+        "Net Pay": gross - deductions,
+    }, index=employees.index).round(2)
+
+def payroll_input_hash(employees, period):
+    # Numbers are hashed as floats so an int column read back as float doesn't count as a change
+    inputs = pd.DataFrame({
+        "name": employees["Employee Name"].astype(str),
+        "salary": pd.to_numeric(employees["Salary"], errors="coerce").astype(float),
+        "attendance": pd.to_numeric(employees["Attendance"], errors="coerce").astype(float),
+        "period": period,
+        "rules": PAYROLL_RULES,
+    })
+    return pd.util.hash_pandas_object(inputs, index=False).map("{:016x}".format)
+
+def run_payroll(period, recompute_all=False):
+    """Append payslips for period; returns (the new batch, employees left unchanged)."""
+    employees_file = "data/employees.csv"
+    payslips_file = "data/payslips.csv"
+    # Attendance over the period itself (up to today) wherever it was
+    # tracked; everyone else is paid on their entered Attendance
+    month = pd.Period(period, freq="M")
+    start, end = month.start_time.date(), min(month.end_time.date(), date.today())
+    tracked = recorded_attendance(start, end) if start <= end else pd.Series(dtype=float)
+    result = {}
+
+    # Compared and appended on the writer thread so two runs of a period
+    # can't both decide the same employee needs a new payslip
+    def prepare(next_id):
+        employees = load_current(employees_file)
+        if employees.empty:
+            employees = pd.DataFrame(columns=["Employee ID", "Employee Name", "Salary", "Attendance"])
+        employees = employees.dropna(subset=["Employee ID"]).drop_duplicates("Employee ID", keep="last")
+        employees["Attendance"] = employees["Employee ID"].astype(str).map(tracked).fillna(pd.to_numeric(employees["Attendance"], errors="coerce"))
+        hashes = payroll_input_hash(employees, period)
+        total = len(employees)
+        if not recompute_all:
+            issued = load_current(payslips_file, where={"Pay Period": period})
+            if not issued.empty:
+                latest = issued.drop_duplicates("Employee ID", keep="last").set_index("Employee ID")["Input Hash"]
+                changed = (employees["Employee ID"].map(latest) != hashes).to_numpy()
+                employees, hashes = employees[changed], hashes[changed]
+        result["unchanged"] = total - len(employees)
+        if employees.empty:
+            result["batch"] = pd.DataFrame()
+            return {}
+        now = datetime.now()
+        run_id = f"PR{now:%Y%m%d%H%M%S%f}"
+        result["batch"] = pd.concat([
+            pd.DataFrame({
+                "Payslip ID": run_id + "-" + employees["Employee ID"].astype(str),
+                "Run ID": run_id,
+                "Pay Period": period,
+                "Run Date": now.strftime("%Y-%m-%d"),
+                "Employee ID": employees["Employee ID"],
+                "Employee Name": employees["Employee Name"],
+                "Input Hash": hashes,
+            }),
+            compute_payroll(employees),
+        ], axis=1).reset_index(drop=True)
+        return {payslips_file: result["batch"].to_dict("records")}
+
+    write_transaction(prepare)
+    return result["batch"], result["unchanged"]
+
+# Attendance
+# Daily attendance is one bit per employee per day: each year is a
+# (employees x 46 bytes) uint8 matrix saved as data/attendance/<year>.npz,
+# so 10k employees cost under 0.5MB a year. Queries AND the rows with a
+# mask of the days asked about and popcount the bytes through a lookup table.
+# Only weekdays count as working days.
+ATTENDANCE_DIR = "data/attendance"
+ATTENDANCE_BYTES = 46  # 366 days
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _day_mask(year, start=None, end=None):
+    """Bitmask bytes of the working days of year between start and end."""
+    days = pd.date_range(max(start, date(year, 1, 1)) if start else date(year, 1, 1), min(end, date(year, 12, 31)) if end else date(year, 12, 31))
+    days = days[days.weekday < 5]
+    bits = np.zeros(ATTENDANCE_BYTES * 8, dtype=np.uint8)
+    bits[days.dayofyear - 1] = 1
+    return np.packbits(bits, bitorder="little")
+
+class AttendanceStore:
+    """Per-year attendance bitsets keyed by Employee ID."""
+
+    def __init__(self, directory=ATTENDANCE_DIR):
+        self.directory = directory
+        self.lock = threading.RLock()
+        # {year: (list of Employee IDs, {Employee ID: row}, uint8 bits)}
+        self.years = {}
+
+    def _year(self, year):
+        if year not in self.years:
+            try:
+                with np.load(os.path.join(self.directory, f"{year}.npz"), allow_pickle=False) as saved:
+                    ids = [str(employee_id) for employee_id in saved["ids"]]
+                    bits = saved["bits"]
+            except FileNotFoundError:
+                ids, bits = [], np.zeros((0, ATTENDANCE_BYTES), dtype=np.uint8)
+            self.years[year] = (ids, {employee_id: row for row, employee_id in enumerate(ids)}, bits)
+        return self.years[year]
+
+    def _rows(self, year, employee_ids):
+        ids, rows, bits = self._year(year)
+        new = [employee_id for employee_id in dict.fromkeys(employee_ids) if employee_id not in rows]
+        if new:
+            for employee_id in new:
+                rows[employee_id] = len(ids)
+                ids.append(employee_id)
+            bits = np.vstack([bits, np.zeros((len(new), ATTENDANCE_BYTES), dtype=np.uint8)])
+            self.years[year] = (ids, rows, bits)
+        return np.array([rows[employee_id] for employee_id in employee_ids], dtype=np.int64)
+
+    def _save(self, year):
+        ids, _, bits = self.years[year]
+        path = os.path.join(self.directory, f"{year}.npz")
+        _write_file_atomic(path, lambda f: np.savez(f, ids=np.array(ids, dtype=str), bits=bits), mode="wb")
+
+    def record(self, employee_ids, days):
+        """Mark each (employee, day) pair present; returns how many pairs were new."""
+        frame = pd.DataFrame({"employee": pd.Series(employee_ids, dtype=str).to_numpy(), "day": pd.to_datetime(pd.Series(days)).to_numpy()})
+        frame = frame.dropna().drop_duplicates()
+        added = 0
+        with self.lock:
+            for year, group in frame.groupby(frame["day"].dt.year):
+                rows = self._rows(year, group["employee"].tolist())
+                offsets = group["day"].dt.dayofyear.to_numpy() - 1
+                bits = self.years[year][2]
+                masks = (1 << (offsets & 7)).astype(np.uint8)
+                added += int(((bits[rows, offsets >> 3] & masks) == 0).sum())
+                np.bitwise_or.at(bits, (rows, offsets >> 3), masks)
+                self._save(year)
+        return added
+
+    def attendance(self, start, end):
+        """Series of attendance % per employee over the working days from start to end."""
+        attended, working = Counter(), 0
+        with self.lock:
+            for year in range(start.year, end.year + 1):
+                mask = _day_mask(year, start, end)
+                working += int(POPCOUNT[mask].sum())
+                ids, _, bits = self._year(year)
+                if ids:
+                    attended.update(dict(zip(ids, POPCOUNT[bits & mask].sum(axis=1).tolist())))
+        if not working:
+            return pd.Series(dtype=float)
+        return (pd.Series(attended, dtype=float) / working * 100).round(1)
+
+    def present(self, day):
+        """Employee IDs recorded present on day."""
+        with self.lock:
+            ids, _, bits = self._year(day.year)
+            offset = day.timetuple().tm_yday - 1
+            hits = (bits[:, offset >> 3] >> (offset & 7)) & 1 if ids else np.zeros(0, dtype=np.uint8)
+            return {employee_id for employee_id, hit in zip(ids, hits) if hit}
+
+    def days(self, employee_id, year):
+        """Boolean array, one entry per day of year, for an employee."""
+        with self.lock:
+            _, rows, bits = self._year(year)
+            row = rows.get(employee_id)
+            if row is None:
+                return np.zeros(ATTENDANCE_BYTES * 8, dtype=bool)
+            return np.unpackbits(bits[row], bitorder="little").astype(bool)
+
+    def streaks(self, employee_id, end):
+        """(current, longest) runs of attended working days in end's year, up to end."""
+        present = self.days(employee_id, end.year)
+        working = np.unpackbits(_day_mask(end.year, end=end), bitorder="little").astype(bool)
+        attended = present[working].astype(np.int8)
+        if not attended.size:
+            return 0, 0
+        # Run lengths of 1s, from the positions where the series flips
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], attended, [0]])))
+        runs = edges[1::2] - edges[::2]
+        longest = int(runs.max()) if runs.size else 0
+        current = int(runs[-1]) if runs.size and attended[-1] else 0
+        return current, longest
+
+@st.cache_resource
+def _attendance_store():
+    return AttendanceStore()
+
+def get_attendance_store():
+    return _attendance_store()
+
+def ingest_clock_events(events):
+    """Record attendance from check-in/check-out rows (Employee ID, Timestamp[, Event])."""
+    if "Event" in events.columns:
+        # A day counts once the employee has checked in
+        events = events[events["Event"].astype(str).str.strip().str.lower().isin(["in", "check-in", "checkin"])]
+    days = pd.to_datetime(events["Timestamp"], errors="coerce").dt.normalize()
+    return get_attendance_store().record(events["Employee ID"].astype(str).str.strip(), days)
+
+def recorded_attendance(start, end):
+    """Attendance % over start..end of the employees who attended at least one working day in it."""
+    percent = get_attendance_store().attendance(start, end)
+    return percent[percent > 0]
+
+def sync_attendance_column(start=None, end=None):
+    """Set employees' Attendance to their % over start..end (this month so far by
+    default); employees who attended no working day in it keep their value.
+    Payroll works out attendance for its own pay period and only falls back to this column."""
+    end = end or date.today()
+    start = start or end.replace(day=1)
+    employees_file = "data/employees.csv"
+    percent = recorded_attendance(start, end)
+    if percent.empty:
+        return 0
+
+    # Read and rewritten on the writer thread so a queued edit of an
+    # employee is neither missed nor overwritten by a stale row
+    def prepare(next_id):
+        employees = load_current(employees_file)
+        if employees.empty:
+            return {}
+        derived = employees["Employee ID"].astype(str).map(percent)
+        changed = derived.notna() & (derived != pd.to_numeric(employees["Attendance"], errors="coerce"))
+        return {employees_file: plain_rows(employees[changed].assign(Attendance=derived[changed]))}
+
+    return len(write_transaction(prepare).get(employees_file, []))
+
+# Sales Leaderboards
+# Weekly (Monday-based) and all-time sale counts and revenue per product and
+# per customer, updated as sales are appended.
+LEADERBOARD_SIZE = 3
+
+LEADERBOARD_DIMENSIONS = {
+    "product": "Product Name",
+    "customer": "Customer Name",
+}
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+class SalesLeaderboard(TableView):
+    """Rolling weekly and all-time top-N boards for products and customers."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        # {week start or None for all-time: {dimension: {"count": Counter, "revenue": Counter}}}
+        self.boards = {}
+
+    def update(self, df):
+        if "Sale Date" not in df.columns:
+            return
+        dates = pd.to_datetime(df["Sale Date"], errors="coerce")
+        weeks = (dates - pd.to_timedelta(dates.dt.weekday, unit="D")).dt.date
+        revenue = pd.to_numeric(df.get("Total Price"), errors="coerce").fillna(0.0)
+        for dimension, column in LEADERBOARD_DIMENSIONS.items():
+            if column not in df.columns:
+                continue
+            frame = pd.DataFrame({"week": weeks, "name": df[column], "revenue": revenue}).dropna(subset=["name"])
+            by_week = frame.dropna(subset=["week"]).groupby(["week", "name"], sort=False)["revenue"].agg(["size", "sum"])
+            all_time = frame.groupby("name", sort=False)["revenue"].agg(["size", "sum"])
+            for (week, name), count, total in zip(by_week.index, by_week["size"], by_week["sum"]):
+                self._add(week, dimension, name, count, total)
+            for name, count, total in zip(all_time.index, all_time["size"], all_time["sum"]):
+                self._add(None, dimension, name, count, total)
+
+    def _add(self, week, dimension, name, count, total):
+        board = self.boards.setdefault(week, {}).setdefault(dimension, {"count": Counter(), "revenue": Counter()})
+        board["count"][name] += int(count)
+        board["revenue"][name] += float(total)
+
+    def top(self, dimension, n=1, week=None, by="count"):
+        """Top n (name, count, revenue) rows; week=None means all-time."""
+        with self.lock:
+            board = self.boards.get(week, {}).get(dimension)
+            if not board:
+                return []
+            return [(name, board["count"][name], board["revenue"][name]) for name, _ in board[by].most_common(n)]
+
+@st.cache_resource
+def _sales_leaderboard():
+    return SalesLeaderboard()
+
+register_view("data/sales.csv", _sales_leaderboard)
+
+def get_sales_leaderboard():
+    return _sales_leaderboard().refresh()
+
+# Sales Rollups
+# Materialized count / quantity / revenue per day, week and month, overall
+# and per payment method, plus per product at week and month grain (a
+# product-by-day table would be nearly as large as the sales themselves).
+# Committed sales are folded in incrementally, so trend charts never touch
+# raw transactions.
+ROLLUP_GRAINS = ("day", "week", "month")
+ROLLUP_DIMENSIONS = {
+    None: ("day", "week", "month"),
+    "Payment Method": ("day", "week", "month"),
+    "Product Name": ("week", "month"),
+}
+ROLLUP_MEASURES = ("Sales", "Quantity", "Revenue")
+CHART_MAX_POINTS = 1000
+
+def period_start(dates, grain):
+    """Start date of each date's day, (Monday-based) week or month."""
+    dates = dates.dt.normalize()
+    if grain == "week":
+        return dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+    if grain == "month":
+        return dates - pd.to_timedelta(dates.dt.day - 1, unit="D")
+    return dates
+
+class SalesRollups(TableView):
+    """Incrementally maintained sales totals by period and dimension."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        # {(dimension, grain): {(period, value): [sales, quantity, revenue]}}
+        self.tables = {(dimension, grain): {} for dimension, grains in ROLLUP_DIMENSIONS.items() for grain in grains}
+
+    def update(self, df):
+        if "Sale Date" not in df.columns:
+            return
+        frame = pd.DataFrame({
+            "date": pd.to_datetime(df["Sale Date"], errors="coerce"),
+            "quantity": pd.to_numeric(df.get("Quantity Sold"), errors="coerce").fillna(0.0),
+            "revenue": pd.to_numeric(df.get("Total Price"), errors="coerce").fillna(0.0),
+        })
+        for dimension in ROLLUP_DIMENSIONS:
+            frame["value"] = df[dimension] if dimension in df.columns else None
+            valid = frame.dropna(subset=["date"] + (["value"] if dimension else []))
+            for grain in ROLLUP_DIMENSIONS[dimension]:
+                groups = valid.assign(period=period_start(valid["date"], grain)).groupby(["period", "value"], sort=False, dropna=False)
+                totals = groups.agg(sales=("revenue", "size"), quantity=("quantity", "sum"), revenue=("revenue", "sum"))
+                table = self.tables[(dimension, grain)]
+                for key, sales, quantity, revenue in zip(totals.index, totals["sales"], totals["quantity"], totals["revenue"]):
+                    cell = table.get(key)
+                    if cell is None:
+                        table[key] = [int(sales), float(quantity), float(revenue)]
+                    else:
+                        cell[0] += int(sales)
+                        cell[1] += float(quantity)
+                        cell[2] += float(revenue)
+
+    def series(self, grain="day", measure="Revenue", dimension=None, start=None, end=None):
+        """Measure per period (one column per dimension value), oldest first."""
+        with self.lock:
+            table = self.tables.get((dimension, grain), {})
+            position = ROLLUP_MEASURES.index(measure)
+            records = [(period, value, cell[position]) for (period, value), cell in table.items()]
+        frame = pd.DataFrame(records, columns=["Period", "Value", measure])
+        if start is not None:
+            frame = frame[frame["Period"] >= period_start(pd.Series([pd.Timestamp(start)]), grain)[0]]
+        if end is not None:
+            frame = frame[frame["Period"] <= pd.Timestamp(end)]
+        if dimension is None:
+            return frame.set_index("Period")[[measure]].sort_index()
+        return frame.pivot_table(index="Period", columns="Value", values=measure, aggfunc="sum", fill_value=0).sort_index()
+
+@st.cache_resource
+def _sales_rollups():
+    return SalesRollups()
+
+register_view("data/sales.csv", _sales_rollups)
+
+def get_sales_rollups():
+    return _sales_rollups().refresh()
+
+# Sales Cube
+# Sales folded into cells per product x customer x payment method x day,
+# and again without the customer (most questions don't need it, and those
+# cells are far fewer). Dimensions are dictionary-encoded (each distinct
+# value gets an int code) and cells are parallel numpy arrays of codes,
+# period starts and measures, so a slice is a few vectorized comparisons
+# and a roll-up (to week or month, or across dimensions) is a bincount
+# over the smallest cuboid that has the dimensions asked for, never the
+# raw sales. New sales add to their cells or append new ones.
+CUBE_DIMENSIONS = ("Product Name", "Customer Name", "Payment Method")
+CUBE_CUBOIDS = (CUBE_DIMENSIONS, ("Product Name", "Payment Method"))
+CUBE_PERIOD = "Period"
+CUBE_MISSING = "(none)"
+CUBE_TOP = 50
+CUBE_DENSE_MAX = 1 << 22
+
+def _period_days(days, grain):
+    # days count from DAY_EPOCH (1970-01-01, a Thursday)
+    if grain == "week":
+        return days - (days + 3) % 7
+    if grain == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    return days
+
+def _group_sums(groups, measures):
+    """(distinct key columns, summed measures) of measures grouped by the int arrays in groups."""
+    low = [group.min() for group in groups]
+    shape = [int(group.max() - lo) + 1 for group, lo in zip(groups, low)]
+    packed = np.ravel_multi_index([group - lo for group, lo in zip(groups, low)], shape)
+    space = int(np.prod(shape, dtype=np.float64))
+    if space <= max(CUBE_DENSE_MAX, 4 * len(packed)):
+        # Small key space: total straight into it, no sort needed
+        sums = np.column_stack([np.bincount(packed, weights=measures[:, i], minlength=space) for i in range(measures.shape[1])])
+        cells = np.flatnonzero(sums[:, 0])
+        sums = sums[cells]
+    else:
+        cells, inverse = np.unique(packed, return_inverse=True)
+        sums = np.column_stack([np.bincount(inverse, weights=measures[:, i], minlength=len(cells)) for i in range(measures.shape[1])])
+    return [column + lo for column, lo in zip(np.unravel_index(cells, shape), low)], sums
+
+class _Cuboid:
+    """Cube cells over one subset of the cube's dimensions."""
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        # {(code per dimension..., day): cell}; cells [0, size) of the arrays are used
+        self.cells = {}
+        self.size = 0
+        self.columns = {dimension: np.zeros(0, dtype=np.int32) for dimension in dimensions}
+        self.periods = {grain: np.zeros(0, dtype=np.int32) for grain in ROLLUP_GRAINS}
+        self.measures = np.zeros((0, len(ROLLUP_MEASURES)), dtype=np.float64)
+
+    def _grow(self, needed):
+        capacity = len(self.measures)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 1024)
+        for arrays in (self.columns, self.periods):
+            for name, array in arrays.items():
+                arrays[name] = np.resize(array, capacity)
+        self.measures = np.resize(self.measures, (capacity, len(ROLLUP_MEASURES)))
+
+    def add(self, codes, days, measures):
+        # Fold the batch into distinct cells first
+        keys, totals = _group_sums([codes[dimension] for dimension in self.dimensions] + [days], measures)
+        keys = list(zip(*(column.tolist() for column in keys)))
+        # Then add to existing cells and append new ones
+        index = np.fromiter((self.cells.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        existing = index >= 0
+        self.measures[index[existing]] += totals[existing]
+        new = np.flatnonzero(~existing)
+        if not len(new):
+            return
+        start, stop = self.size, self.size + len(new)
+        self._grow(stop)
+        for position, dimension in enumerate(self.dimensions):
+            self.columns[dimension][start:stop] = [keys[i][position] for i in new]
+        new_days = np.array([keys[i][-1] for i in new], dtype=np.int64)
+        for grain in ROLLUP_GRAINS:
+            self.periods[grain][start:stop] = _period_days(new_days, grain)
+        self.measures[start:stop] = totals[new]
+        self.cells.update(zip((keys[i] for i in new), range(start, stop)))
+        self.size = stop
+
+class SalesCube(TableView):
+    """Sales counts, quantities and revenue by product, customer, payment method and day."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        # Per dimension: {value: code} and the values by code
+        self.codes = {dimension: {} for dimension in CUBE_DIMENSIONS}
+        self.values = {dimension: [] for dimension in CUBE_DIMENSIONS}
+        self.cuboids = [_Cuboid(dimensions) for dimensions in CUBE_CUBOIDS]
+
+    def _encode(self, dimension, values):
+        values = values.fillna(CUBE_MISSING).astype(str)
+        local, uniques = pd.factorize(values)
+        codes, known = self.codes[dimension], self.values[dimension]
+        for value in uniques:
+            if value not in codes:
+                codes[value] = len(known)
+                known.append(value)
+        return np.array([codes[value] for value in uniques], dtype=np.int32)[local]
+
+    def update(self, df):
+        if "Sale Date" not in df.columns:
+            return
+        days = (pd.to_datetime(df["Sale Date"], errors="coerce") - DAY_EPOCH).dt.days
+        valid = days.notna().to_numpy()
+        if not valid.any():
+            return
+        df = df[valid]
+        missing = pd.Series(None, index=df.index, dtype=object)
+        codes = {dimension: self._encode(dimension, df[dimension] if dimension in df.columns else missing) for dimension in CUBE_DIMENSIONS}
+        measures = np.column_stack([
+            np.ones(len(df)),
+            pd.to_numeric(df.get("Quantity Sold"), errors="coerce").fillna(0.0).to_numpy(dtype=np.float64),
+            pd.to_numeric(df.get("Total Price"), errors="coerce").fillna(0.0).to_numpy(dtype=np.float64),
+        ])
+        days = days[valid].to_numpy(dtype=np.int64)
+        for cuboid in self.cuboids:
+            cuboid.add(codes, days, measures)
+
+    def query(self, by=(), filters=None, grain="day", start=None, end=None):
+        """Measures grouped by the dimensions in by (CUBE_PERIOD groups by
+        grain), over cells matching filters ({dimension: value or list};
+        CUBE_PERIOD takes a (grain, period start) pair) and the date range."""
+        columns = list(by) + list(ROLLUP_MEASURES)
+        filters = filters or {}
+        needed = {dimension for dimension in list(by) + list(filters) if dimension != CUBE_PERIOD}
+        with self.lock:
+            cuboid = min((cuboid for cuboid in self.cuboids if needed <= set(cuboid.dimensions)), key=lambda cuboid: cuboid.size)
+            size = cuboid.size
+            mask = None
+            conditions = []
+            if start is not None:
+                conditions.append(cuboid.periods["day"][:size] >= _epoch_day(start))
+            if end is not None:
+                conditions.append(cuboid.periods["day"][:size] <= _epoch_day(end))
+            for dimension, value in filters.items():
+                if dimension == CUBE_PERIOD:
+                    period_grain, period = value
+                    conditions.append(cuboid.periods[period_grain][:size] == _epoch_day(period))
+                    continue
+                wanted = value if isinstance(value, (list, tuple, set)) else [value]
+                codes = [self.codes[dimension][item] for item in wanted if item in self.codes[dimension]]
+                conditions.append(np.isin(cuboid.columns[dimension][:size], codes))
+            for condition in conditions:
+                mask = condition if mask is None else mask & condition
+            pick = slice(0, size) if mask is None else mask
+            groups = [cuboid.periods[grain][:size][pick] if dimension == CUBE_PERIOD else cuboid.columns[dimension][:size][pick] for dimension in by]
+            measures = cuboid.measures[:size][pick]
+            decode = {dimension: np.array(self.values[dimension], dtype=object) for dimension in by if dimension != CUBE_PERIOD}
+        if not len(measures):
+            return pd.DataFrame(columns=columns)
+        if not groups:
+            return self._frame([measures.sum(axis=0)], columns)
+        keys, sums = _group_sums(groups, measures)
+        result = {
+            dimension: DAY_EPOCH + pd.to_timedelta(codes, unit="D") if dimension == CUBE_PERIOD else decode[dimension][codes]
+            for dimension, codes in zip(by, keys)
+        }
+        result.update(zip(ROLLUP_MEASURES, sums.T))
+        return self._frame(result, columns)
+
+    @staticmethod
+    def _frame(result, columns):
+        frame = pd.DataFrame(result, columns=columns)
+        frame["Sales"] = frame["Sales"].astype(np.int64)
+        return frame
+
+@st.cache_resource
+def _sales_cube():
+    return SalesCube()
+
+register_view("data/sales.csv", _sales_cube)
+
+def get_sales_cube():
+    return _sales_cube().refresh()
+
+# Customer Segments
+# Running per-customer aggregates (first and last purchase day, number of
+# purchases, total spent, purchases per payment method) kept in numpy
+# arrays indexed by a customer code and folded forward as sales commit.
+# Recency / frequency / monetary scores (quintiles, 5 = best) and segments
+# for every customer come from one vectorized pass over those arrays, done
+# once per data version and day; customers are then ordered by segment so
+# a campaign audience is a slice per segment rather than a scan.
+RFM_SEGMENTS = [
+    # (segment, condition on the R, F and M score arrays), first match wins
+    ("Champions", lambda r, f, m: (r >= 4) & (f >= 4) & (m >= 4)),
+    ("Loyal", lambda r, f, m: (r >= 3) & (f >= 4)),
+    ("Can't Lose", lambda r, f, m: (r <= 2) & (f >= 4) & (m >= 4)),
+    ("At Risk", lambda r, f, m: (r <= 2) & (f >= 3)),
+    ("New", lambda r, f, m: (r >= 4) & (f <= 1)),
+    ("Potential Loyalists", lambda r, f, m: (r >= 4) & (f <= 3)),
+    ("Hibernating", lambda r, f, m: (r <= 2) & (f <= 2)),
+    ("Need Attention", lambda r, f, m: np.ones(len(r), dtype=bool)),
+]
+
+def _quintile_scores(values):
+    # 1-5 by rank; equal values share their average rank and so their score
+    if not len(values):
+        return np.zeros(0, dtype=np.int8)
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(counts) - counts + (counts - 1) / 2)[inverse]
+    return np.minimum((ranks + 0.5) * 5 // len(values) + 1, 5).astype(np.int8)
+
+class CustomerProfiles(TableView):
+    """Per-customer purchase aggregates with RFM scores and segments."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        self.codes = {}
+        self.names = []
+        self.methods = {}
+        self.first_day = np.zeros(0, dtype=np.int64)
+        self.last_day = np.zeros(0, dtype=np.int64)
+        self.purchases = np.zeros(0, dtype=np.int64)
+        self.spent = np.zeros(0, dtype=np.float64)
+        # purchases by (customer, payment method code)
+        self.by_method = np.zeros((0, 0), dtype=np.int64)
+        self.version = 0
+        self.scored = None
+
+    def _grow(self, customers, methods):
+        size, width = self.by_method.shape
+        if customers > len(self.purchases):
+            capacity = max(customers, 2 * len(self.purchases), 1024)
+            self.first_day = np.concatenate([self.first_day, np.full(capacity - len(self.first_day), np.iinfo(np.int64).max)])
+            self.last_day = np.concatenate([self.last_day, np.full(capacity - len(self.last_day), np.iinfo(np.int64).min)])
+            self.purchases = np.concatenate([self.purchases, np.zeros(capacity - len(self.purchases), dtype=np.int64)])
+            self.spent = np.concatenate([self.spent, np.zeros(capacity - len(self.spent))])
+            size = capacity
+        if size > self.by_method.shape[0] or methods > width:
+            grown = np.zeros((size, max(methods, width)), dtype=np.int64)
+            grown[:self.by_method.shape[0], :width] = self.by_method
+            self.by_method = grown
+
+    @staticmethod
+    def _encode(values, codes, names=None):
+        # Batch-local codes from factorize, mapped to stable codes once per distinct value
+        local, uniques = pd.factorize(values)
+        for value in uniques:
+            if value not in codes:
+                codes[value] = len(codes)
+                if names is not None:
+                    names.append(value)
+        return local, np.array([codes[value] for value in uniques], dtype=np.int64)
+
+    def update(self, df):
+        if "Customer Name" not in df.columns or "Sale Date" not in df.columns:
+            return
+        days = (pd.to_datetime(df["Sale Date"], errors="coerce") - DAY_EPOCH).dt.days
+        valid = (df["Customer Name"].notna() & days.notna()).to_numpy()
+        if not valid.any():
+            return
+        local, customers = self._encode(df["Customer Name"][valid], self.codes, self.names)
+        methods = df["Payment Method"][valid].fillna(CUBE_MISSING) if "Payment Method" in df.columns else pd.Series(CUBE_MISSING, index=df.index[valid])
+        method_local, method_codes = self._encode(methods, self.methods)
+        self._grow(len(self.names), len(self.methods))
+        days = days[valid].to_numpy(dtype=np.int64)
+        spent = pd.to_numeric(df.get("Total Price"), errors="coerce")
+        spent = spent[valid].fillna(0.0).to_numpy(dtype=np.float64) if spent is not None else np.zeros(len(days))
+        # Fold the batch per customer, then into the running arrays
+        k = len(customers)
+        first = np.full(k, np.iinfo(np.int64).max)
+        last = np.full(k, np.iinfo(np.int64).min)
+        np.minimum.at(first, local, days)
+        np.maximum.at(last, local, days)
+        self.first_day[customers] = np.minimum(self.first_day[customers], first)
+        self.last_day[customers] = np.maximum(self.last_day[customers], last)
+        self.purchases[customers] += np.bincount(local, minlength=k)
+        self.spent[customers] += np.bincount(local, weights=spent, minlength=k)
+        counts = np.bincount(local * len(method_codes) + method_local, minlength=k * len(method_codes)).reshape(k, len(method_codes))
+        self.by_method[np.ix_(customers, method_codes)] += counts
+        self.version += 1
+
+    def _score(self, today):
+        # Cached per data version and day; callers hold self.lock
+        key = (self.version, today)
+        if self.scored is not None and self.scored[0] == key:
+            return self.scored[1]
+        count = len(self.names)
+        recency = _epoch_day(today) - self.last_day[:count]
+        r = _quintile_scores(-recency)
+        f = _quintile_scores(self.purchases[:count])
+        m = _quintile_scores(self.spent[:count])
+        segment = np.select([condition(r, f, m) for _, condition in RFM_SEGMENTS], np.arange(len(RFM_SEGMENTS)))
+        # Customers grouped by segment, biggest spenders first within each
+        order = np.lexsort((-self.spent[:count], segment))
+        bounds = np.searchsorted(segment[order], np.arange(len(RFM_SEGMENTS) + 1))
+        methods = np.array(list(self.methods), dtype=object)
+        scored = {
+            "recency": recency, "r": r, "f": f, "m": m, "segment": segment, "order": order, "bounds": bounds,
+            "preferred": methods[self.by_method[:count, :len(methods)].argmax(axis=1)] if len(methods) else np.full(count, CUBE_MISSING, dtype=object),
+        }
+        self.scored = (key, scored)
+        return scored
+
+    def _rows(self, codes, scored):
+        names = np.array(self.names, dtype=object)
+        return pd.DataFrame({
+            "Customer Name": names[codes],
+            "Last Purchase": DAY_EPOCH + pd.to_timedelta(self.last_day[codes], unit="D"),
+            "Days Since": scored["recency"][codes],
+            "Purchases": self.purchases[codes],
+            "Total Spent": self.spent[codes].round(2),
+            "Preferred Payment": scored["preferred"][codes],
+            "R": scored["r"][codes],
+            "F": scored["f"][codes],
+            "M": scored["m"][codes],
+            "Segment": np.array([name for name, _ in RFM_SEGMENTS], dtype=object)[scored["segment"][codes]],
+        })
+
+    def segments(self, today=None):
+        """Customers, purchases and spend per segment."""
+        with self.lock:
+            scored = self._score(today or date.today())
+            count = len(self.names)
+            segment = scored["segment"]
+            customers = np.bincount(segment, minlength=len(RFM_SEGMENTS))
+            spent = np.bincount(segment, weights=self.spent[:count], minlength=len(RFM_SEGMENTS))
+            recency = np.bincount(segment, weights=scored["recency"], minlength=len(RFM_SEGMENTS))
+        return pd.DataFrame({
+            "Segment": [name for name, _ in RFM_SEGMENTS],
+            "Customers": customers,
+            "Total Spent": spent.round(2),
+            "Avg Days Since": np.divide(recency, customers, out=np.zeros(len(customers)), where=customers > 0).round(1),
+        })
+
+    def audience(self, segments, preferred_payment=None, min_spent=0.0, today=None):
+        """Customers in the given segments, optionally limited to a preferred
+        payment method and minimum spend, biggest spenders first per segment."""
+        names = [name for name, _ in RFM_SEGMENTS]
+        with self.lock:
+            scored = self._score(today or date.today())
+            bounds, order = scored["bounds"], scored["order"]
+            picked = [order[bounds[i]:bounds[i + 1]] for i in sorted(names.index(segment) for segment in segments)]
+            codes = np.concatenate(picked) if picked else np.zeros(0, dtype=np.int64)
+            if preferred_payment:
+                codes = codes[scored["preferred"][codes] == preferred_payment]
+            if min_spent:
+                codes = codes[self.spent[codes] >= min_spent]
+            return self._rows(codes, scored)
+
+    def payment_methods(self):
+        return list(self.methods)
+
+@st.cache_resource
+def _customer_profiles():
+    return CustomerProfiles()
+
+register_view("data/sales.csv", _customer_profiles)
+
+def get_customer_profiles():
+    return _customer_profiles().refresh()
+
+# Formulations
+# A formulation line is the quantity of a component that goes into one unit
+# of a product; a component with lines of its own is a sub-assembly and one
+# without is a raw material. Lines are keyed upserts, so saving a line with
+# quantity 0 removes it. Every item is exploded once, components before the
+# products made from them (topological order), into a per-unit vector of
+# raw materials built from its components' already-exploded vectors; the
+# vectors are kept until the formulations change. Planning a set of batches
+# is then one gather and a weighted bincount over those vectors, and netting
+# against stock is one array subtraction.
+MRP_OPEN_STATUSES = ["Scheduled", "Planned"]
+
+class Formulations(TableView):
+    """Multi-level formulations (bills of materials) and material requirements."""
+
+    filename = "data/formulations.csv"
+
+    def reset(self):
+        # {Line ID: (Product Name, Component)}
+        self.lines = {}
+        # {Product Name: {Component: (Line ID, Quantity)}}
+        self.recipes = {}
+        self.exploded = None
+
+    def update(self, df):
+        if "Line ID" not in df.columns:
+            return
+        quantity = pd.to_numeric(df.get("Quantity"), errors="coerce").fillna(0.0)
+        for line_id, product, component, amount in zip(df["Line ID"], df["Product Name"], df["Component"], quantity):
+            previous = self.lines.pop(line_id, None)
+            if previous is not None:
+                recipe = self.recipes.get(previous[0], {})
+                if recipe.get(previous[1], (None,))[0] == line_id:
+                    del recipe[previous[1]]
+                if not recipe:
+                    self.recipes.pop(previous[0], None)
+            if amount > 0 and isinstance(product, str) and isinstance(component, str):
+                self.lines[line_id] = (product, component)
+                self.recipes.setdefault(product, {})[component] = (line_id, float(amount))
+        self.exploded = None
+
+    def _order(self):
+        # Kahn's algorithm: raw materials first, each product after all its components
+        users = {}
+        for product, recipe in self.recipes.items():
+            for component in recipe:
+                users.setdefault(component, []).append(product)
+        waiting = {product: len(recipe) for product, recipe in self.recipes.items()}
+        ready = sorted(item for item in users if item not in self.recipes)
+        order = []
+        while ready:
+            item = ready.pop()
+            order.append(item)
+            for product in users.get(item, ()):
+                waiting[product] -= 1
+                if not waiting[product]:
+                    ready.append(product)
+        stuck = sorted(product for product, count in waiting.items() if count)
+        if stuck:
+            raise ValueError(f"Formulations form a cycle through {', '.join(stuck[:5])}.")
+        return order
+
+    def _explode(self):
+        # Memoized until the next update; callers hold self.lock
+        if self.exploded is not None:
+            return self.exploded
+        order = self._order()
+        materials = sorted(item for item in order if item not in self.recipes)
+        codes = {material: code for code, material in enumerate(materials)}
+        # {item: (raw material codes, quantity per unit of item), depth}
+        vectors, depth = {}, {}
+        for item in order:
+            recipe = self.recipes.get(item)
+            if recipe is None:
+                vectors[item] = (np.array([codes[item]]), np.ones(1))
+                depth[item] = 0
+                continue
+            parts = [vectors[component] for component in recipe]
+            scale = np.repeat([amount for _, amount in recipe.values()], [len(part[0]) for part in parts])
+            merged, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+            vectors[item] = (merged, np.bincount(inverse, weights=np.concatenate([part[1] for part in parts]) * scale))
+            depth[item] = 1 + max(depth[component] for component in recipe)
+        # Products laid out CSR-style: product i's vector is flat[pointer[i]:pointer[i + 1]]
+        products = {product: i for i, product in enumerate(self.recipes)}
+        parts = [vectors[product] for product in products]
+        pointer = np.concatenate([[0], np.cumsum([len(part[0]) for part in parts])]).astype(np.int64)
+        flat_codes = np.concatenate([part[0] for part in parts]) if parts else np.zeros(0, dtype=np.int64)
+        flat_amounts = np.concatenate([part[1] for part in parts]) if parts else np.zeros(0)
+        self.exploded = {
+            "materials": materials, "products": products, "depth": depth,
+            "pointer": pointer, "codes": flat_codes, "amounts": flat_amounts,
+        }
+        return self.exploded
+
+    def products(self):
+        with self.lock:
+            return sorted(self.recipes)
+
+    def components(self, product):
+        """Direct lines of a product's formulation."""
+        with self.lock:
+            recipe = self.recipes.get(product, {})
+            rows = [(component, line_id, amount, "Sub-assembly" if component in self.recipes else "Raw material") for component, (line_id, amount) in recipe.items()]
+        return pd.DataFrame(rows, columns=["Component", "Line ID", "Quantity", "Type"])
+
+    def creates_cycle(self, product, component):
+        """Whether making product from component would make product its own input."""
+        with self.lock:
+            stack, seen = [component], set()
+            while stack:
+                item = stack.pop()
+                if item == product:
+                    return True
+                if item not in seen:
+                    seen.add(item)
+                    stack.extend(self.recipes.get(item, ()))
+            return False
+
+    def depth(self, product):
+        with self.lock:
+            return self._explode()["depth"].get(product, 0)
+
+    def requirements(self, batches, stock=None):
+        """Raw materials for batches (Product Name, Quantity Produced), netted
+        against stock ({material: on hand}); returns (requirements, products
+        with no formulation)."""
+        with self.lock:
+            exploded = self._explode()
+        products, pointer = exploded["products"], exploded["pointer"]
+        materials = exploded["materials"]
+        quantity = pd.to_numeric(batches["Quantity Produced"], errors="coerce").fillna(0.0).groupby(batches["Product Name"]).sum()
+        known = quantity.index.isin(list(products))
+        index = np.array([products[product] for product in quantity.index[known]], dtype=np.int64)
+        # Gather every batch product's slice of the flat vectors at once
+        starts, lengths = pointer[index], pointer[index + 1] - pointer[index]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = exploded["amounts"][offsets] * np.repeat(quantity.to_numpy()[known], lengths)
+        required = np.bincount(exploded["codes"][offsets], weights=weights, minlength=len(materials))
+        on_hand = pd.Series(stock or {}, dtype=float).reindex(materials).fillna(0.0).to_numpy()
+        plan = pd.DataFrame({
+            "Material": materials,
+            "Required": required.round(3),
+            "On Hand": on_hand,
+            "Shortfall": np.maximum(required - on_hand, 0).round(3),
+        })
+        plan = plan[required > 0].sort_values(["Shortfall", "Required"], ascending=False, kind="stable")
+        return plan.reset_index(drop=True), list(quantity.index[~known])
+
+    def describe(self, product, quantity):
+        """Raw materials for quantity units of product as text, or None."""
+        plan, _ = self.requirements(pd.DataFrame({"Product Name": [product], "Quantity Produced": [quantity]}))
+        if plan.empty:
+            return None
+        return ", ".join(f"{material} x {amount:g}" for material, amount in zip(plan["Material"], plan["Required"]))
+
+@st.cache_resource
+def _formulations():
+    return Formulations()
+
+register_view("data/formulations.csv", _formulations)
+
+def get_formulations():
+    return _formulations().refresh()
+
+def material_plan(date_range=None):
+    """Raw materials needed by open production batches, netted against stock."""
+    batches = load_from_csv("data/production.csv", where={"Status": MRP_OPEN_STATUSES}, columns=["Product Name", "Quantity Produced", "Production Date"], date_range=date_range)
+    inventory = load_from_csv("data/inventory.csv", columns=["Product Name", "Stock Quantity"])
+    stock = pd.to_numeric(inventory.get("Stock Quantity"), errors="coerce").fillna(0).groupby(inventory.get("Product Name")).sum().clip(lower=0) if not inventory.empty else pd.Series(dtype=float)
+    if batches.empty:
+        batches = pd.DataFrame({"Product Name": [], "Quantity Produced": []})
+    plan, unplanned = get_formulations().requirements(batches, stock.to_dict())
+    return plan, unplanned, len(batches)
+
+def save_formulation_line(product, component, quantity):
+    """Add, change or (quantity 0) remove the product/component line; returns it."""
+    formulations_file = "data/formulations.csv"
+
+    # The existing line is looked up on the writer thread so two saves of
+    # the same pair update one line rather than adding two
+    def prepare(next_id):
+        match = load_current(formulations_file, where={"Product Name": product, "Component": component})
+        line_id = match["Line ID"].iloc[-1] if not match.empty else next_id(formulations_file, "Line ID", "F")
+        return {formulations_file: [{"Line ID": line_id, "Product Name": product, "Component": component, "Quantity": float(quantity)}]}
+
+    row, = write_transaction(prepare)[formulations_file]
+    return row
+
+def downsample(df, max_points=CHART_MAX_POINTS):
+    """Largest-Triangle-Three-Buckets downsampling of a chart frame to at most max_points rows."""
+    if len(df) <= max_points or max_points < 3:
+        return df
+    x = np.arange(len(df), dtype=np.float64)
+    # Each column picks its share of the rows, so the union stays within
+    # max_points; with too many columns for a share each, follow their total
+    per_column = max_points // max(len(df.columns), 1)
+    series = [df[column] for column in df.columns]
+    if per_column < 3:
+        series, per_column = [df.sum(axis=1, numeric_only=True)], max_points
+    keep = set()
+    for values in series:
+        keep.update(_lttb(x, values.to_numpy(dtype=np.float64), per_column))
+    return df.iloc[sorted(keep)]
+
+def _lttb(x, y, max_points):
+    # Always keep the first and last point; pick one point per bucket that
+    # forms the largest triangle with the previous pick and the next bucket's mean
+    edges = np.linspace(1, len(x) - 1, max_points - 1).astype(np.int64)
+    picked = [0]
+    for i in range(len(edges) - 1):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = hi, edges[i + 2] if i + 2 < len(edges) else len(x)
+        mean_x, mean_y = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        prev = picked[-1]
+        area = np.abs((x[prev] - mean_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (mean_y - y[prev]))
+        picked.append(lo + int(area.argmax()) if len(area) else lo)
+    picked.append(len(x) - 1)
+    return picked
+
+def sales_trend_chart(key, date_range=None):
+    """Sales trend from the rollups, downsampled to CHART_MAX_POINTS."""
+    grain = st.radio("Group by", ["Day", "Week", "Month"], horizontal=True, key=f"{key}_grain")
+    breakdown = st.selectbox("Break down by", ["Total", "Payment Method", "Product Name"], key=f"{key}_breakdown")
+    dimension = None if breakdown == "Total" else breakdown
+    if grain == "Day" and dimension == "Product Name":
+        st.caption("Product trends are grouped by week.")
+        grain = "Week"
+    start, end = date_range if date_range else (None, None)
+    trend = get_sales_rollups().series(grain.lower(), "Revenue", dimension, start, end)
+    if dimension == "Product Name" and len(trend.columns) > 10:
+        # Keep the chart readable: only the ten best-selling products
+        trend = trend[trend.sum().nlargest(10).index]
+    with span("render", f"chart:{key}") as timing:
+        points = downsample(trend)
+        timing.add(len(points))
+        st.line_chart(points)
+    return trend
+
+def sales_drilldown(key, date_range=None):
+    """Slice-and-dice table over the sales cube: break down by one dimension,
+    drill into a value (which becomes a filter) and roll back up."""
+    cube = get_sales_cube()
+    path = st.session_state.setdefault(f"{key}_path", [])
+    grain = st.radio("Periods", ["Month", "Week", "Day"], horizontal=True, key=f"{key}_grain").lower()
+    start, end = date_range if date_range else (None, None)
+    filters = dict(path)
+    trail = ["All sales"] + [
+        f"{dimension}: {value[1].strftime('%Y-%m-%d') if dimension == CUBE_PERIOD else value}"
+        for dimension, value in path
+    ]
+    st.caption(" › ".join(trail))
+    # A period can be drilled again at a finer grain; the latest period filter wins
+    dimensions = [
+        dimension for dimension in (CUBE_PERIOD,) + CUBE_DIMENSIONS
+        if dimension not in filters or (dimension == CUBE_PERIOD and filters[dimension][0] != "day")
+    ]
+    col1, col2 = st.columns(2)
+    by = col1.selectbox("Break down by", dimensions, key=f"{key}_by")
+    across = col2.selectbox("Across", ["(none)"] + [dimension for dimension in dimensions if dimension != by], key=f"{key}_across")
+    measure = st.radio("Measure", list(ROLLUP_MEASURES), index=2, horizontal=True, key=f"{key}_measure")
+    with span("render", f"cube:{key}"):
+        table = cube.query([by], filters, grain, start, end)
+        if table.empty:
+            st.info("No sales in this slice.")
+        else:
+            totals = table[list(ROLLUP_MEASURES)].sum()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Sales", f"{int(totals['Sales']):,}")
+            col2.metric("Quantity", f"{totals['Quantity']:,.0f}")
+            col3.metric("Revenue", f"Kes {totals['Revenue']:,.2f}")
+            # Periods read in order; other breakdowns lead with their biggest values
+            table = table.sort_values(by) if by == CUBE_PERIOD else table.nlargest(CUBE_TOP, measure)
+            if across == "(none)":
+                st.dataframe(table, hide_index=True)
+            else:
+                cells = cube.query([by, across], {**filters, by: list(table[by])} if by != CUBE_PERIOD else filters, grain, start, end)
+                columns = cells.groupby(across)[measure].sum().nlargest(10).index
+                pivot = cells[cells[across].isin(columns)].pivot_table(index=by, columns=across, values=measure, aggfunc="sum", fill_value=0)
+                st.dataframe(pivot.reindex(table[by]).fillna(0))
+    col1, col2, col3 = st.columns([3, 1, 1])
+    if not table.empty:
+        labels = {(value.strftime("%Y-%m-%d") if by == CUBE_PERIOD else value): value for value in table[by]}
+        choice = col1.selectbox(f"Drill into {by}", list(labels), key=f"{key}_drill")
+        if col2.button("Drill Down", key=f"{key}_down"):
+            path.append((by, (grain, labels[choice]) if by == CUBE_PERIOD else labels[choice]))
+            st.rerun()
+    if path and col3.button("Roll Up", key=f"{key}_up"):
+        path.pop()
+        st.rerun()
+
+# Sales Forecasting
+# One least-squares trend line per product (plus one for all products) over
+# daily revenue, from the product's first sale to the last day with sales,
+# days without sales counting as 0. Each line keeps its first day, Σy and
+# Σxy, so a new sale updates its product in O(1) and nothing is refitted;
+# Σx and Σx² over a run of consecutive days have closed forms. Coefficients
+# are derived lazily once per data version, and forecasts for every product
+# are a single outer product, so changing the horizon is free.
+FORECAST_EPOCH = pd.Timestamp("2000-01-01")
+FORECAST_ALL = "(All Products)"
+
+class SalesForecaster(TableView):
+    """Incremental per-product linear trend of daily revenue."""
+
+    filename = "data/sales.csv"
+
+    def reset(self):
+        self.rows = {}
+        self.names = []
+        # Per series: first day with sales, Σy, Σxy
+        self.stats = np.zeros((0, 3))
+        # Per series row: {day number: revenue}
+        self.daily = []
+        self.last_day = None
+        self.coefficients = None
+
+    def update(self, df):
+        if "Sale Date" not in df.columns or "Product Name" not in df.columns:
+            return
+        days = (pd.to_datetime(df["Sale Date"], errors="coerce") - FORECAST_EPOCH).dt.days
+        revenue = pd.to_numeric(df.get("Total Price"), errors="coerce").fillna(0.0)
+        frame = pd.DataFrame({"series": df["Product Name"], "day": days, "revenue": revenue}).dropna()
+        if frame.empty:
+            return
+        totals = pd.concat([frame, frame.assign(series=FORECAST_ALL)]).groupby(["series", "day"], sort=False)["revenue"].sum()
+        codes, names = pd.factorize(totals.index.get_level_values("series"))
+        rows = np.array([self._row(name) for name in names], dtype=np.int64)[codes]
+        x = totals.index.get_level_values("day").to_numpy(dtype=np.float64)
+        y = totals.to_numpy(dtype=np.float64)
+        for row, day, amount in zip(rows, x.astype(np.int64), y):
+            series = self.daily[row]
+            series[day] = series.get(day, 0.0) + amount
+        np.minimum.at(self.stats[:, 0], rows, x)
+        np.add.at(self.stats[:, 1:], rows, np.column_stack([y, x * y]))
+        last_day = int(x.max())
+        self.last_day = last_day if self.last_day is None else max(self.last_day, last_day)
+        self.coefficients = None
+
+    def _row(self, name):
+        row = self.rows.get(name)
+        if row is None:
+            row = self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.daily.append({})
+            if row >= len(self.stats):
+                # Grow by doubling so adding products stays amortized O(1)
+                grown = np.zeros((max(len(self.stats), 16), 3))
+                grown[:, 0] = np.inf
+                self.stats = np.vstack([self.stats, grown])
+        return row
+
+    def fit(self):
+        """(slope, intercept) arrays for every series, cached until new sales arrive."""
+        with self.lock:
+            if self.coefficients is None:
+                with span("fit", "forecast") as timing:
+                    timing.add(len(self.names))
+                    first, sy, sxy = self.stats[:len(self.names)].T
+                    # Days u = x - first run 0..n-1, so Σu and Σu² are closed
+                    # forms and Σuy = Σxy - first * Σy
+                    n = self.last_day - first + 1
+                    su, suu = n * (n - 1) / 2, (n - 1) * n * (2 * n - 1) / 6
+                    suy = sxy - first * sy
+                    denominator = n * suu - su * su
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        slope = np.where(denominator > 0, (n * suy - su * sy) / denominator, 0.0)
+                        intercept = np.where(n > 0, (sy - slope * su) / n, 0.0) - slope * first
+                    self.coefficients = (slope, intercept)
+            return self.coefficients
+
+    def forecast(self, horizon, series=None):
+        """Daily revenue for the next `horizon` days, one column per series."""
+        with self.lock:
+            if self.last_day is None:
+                return pd.DataFrame()
+            slope, intercept = self.fit()
+            names = list(self.names) if series is None else [name for name in series if name in self.rows]
+            rows = np.array([self.rows[name] for name in names], dtype=np.int64)
+            future = np.arange(self.last_day + 1, self.last_day + 1 + horizon, dtype=np.float64)
+            values = np.clip(intercept[rows] + np.outer(future, slope[rows]), 0.0, None)
+            index = FORECAST_EPOCH + pd.to_timedelta(future, unit="D")
+            return pd.DataFrame(values, index=pd.DatetimeIndex(index, name="Date"), columns=names)
+
+    def history(self, name):
+        """Actual and fitted daily revenue of one series."""
+        with self.lock:
+            row = self.rows.get(name)
+            if row is None:
+                return pd.DataFrame()
+            slope, intercept = self.fit()
+            days = np.arange(min(self.daily[row]), self.last_day + 1, dtype=np.float64)
+            actual = np.array([self.daily[row].get(day, 0.0) for day in days.astype(np.int64)])
+            index = pd.DatetimeIndex(FORECAST_EPOCH + pd.to_timedelta(days, unit="D"), name="Date")
+            return pd.DataFrame({"Actual": actual, "Fitted": intercept[row] + slope[row] * days}, index=index)
+
+@st.cache_resource
+def _sales_forecaster():
+    return SalesForecaster()
+
+register_view("data/sales.csv", _sales_forecaster)
+
+def get_sales_forecaster():
+    return _sales_forecaster().refresh()
+
+# Barcode Index
+# Maps every inventory barcode to its product in a dict, so a scanned code
+# resolves in O(1) at the till. The index is saved next to the inventory
+# with the table signature it reflects, so a restart with unchanged
+# inventory loads it instead of rebuilding it.
+BARCODE_INDEX_PATH = "data/inventory.barcodes.pkl"
+
+class BarcodeIndex(TableView):
+    """Barcode -> (Product ID, Product Name, Unit Price) over inventory."""
+
+    filename = "data/inventory.csv"
+
+    def reset(self):
+        self.products = {}
+        # Product ID -> barcode, so a re-labelled item drops its old code
+        self.barcodes = {}
+        self.reserved = set()
+
+    def refresh(self):
+        with self.lock:
+            if self.signature is None:
+                self._load_saved()
+            rebuilt = self.signature != _table_signature(self.filename)
+            super().refresh()
+            if rebuilt:
+                self._save()
+        return self
+
+    def update(self, df):
+        if "Barcode" not in df.columns:
+            return
+        df = df[df["Barcode"].notna()]
+        prices = pd.to_numeric(df["Unit Price"], errors="coerce") if "Unit Price" in df.columns else pd.Series(float("nan"), index=df.index)
+        for barcode, product_id, name, price in zip(df["Barcode"].astype(str), df["Product ID"], df["Product Name"], prices):
+            old = self.barcodes.get(product_id)
+            if old is not None and old != barcode:
+                self.products.pop(old, None)
+            self.products[barcode] = (product_id, name, None if pd.isna(price) else float(price))
+            self.barcodes[product_id] = barcode
+            self.reserved.discard(barcode)
+
+    def lookup(self, barcode):
+        product = self.products.get(str(barcode).strip())
+        if product is None:
+            return None
+        return {"Product ID": product[0], "Product Name": product[1], "Unit Price": product[2]}
+
+    def in_use(self, barcode):
+        """Whether barcode belongs to an item or has been promised to one."""
+        with self.lock:
+            return barcode in self.products or barcode in self.reserved
+
+    def new_barcode(self):
+        """A random CBW-xxxxxx code that no item has or has been promised."""
+        with self.lock:
+            for _ in range(1000):
+                barcode = f"CBW-{random.randint(100000, 999999)}"
+                if barcode not in self.products and barcode not in self.reserved:
+                    self.reserved.add(barcode)
+                    return barcode
+        raise RuntimeError("Could not find a free barcode; the CBW-xxxxxx range is nearly exhausted.")
+
+    def _load_saved(self):
+        try:
+            with open(BARCODE_INDEX_PATH, "rb") as f:
+                signature, self.products, self.barcodes = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+            return
+        self.reserved = set()
+        self.signature = signature
+
+    def _save(self):
+        payload = (self.signature, self.products, self.barcodes)
+        _write_file_atomic(BARCODE_INDEX_PATH, lambda f: pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL), mode="wb")
+
+@st.cache_resource
+def _barcode_index():
+    return BarcodeIndex()
+
+register_view("data/inventory.csv", _barcode_index)
+
+def get_barcode_index():
+    return _barcode_index().refresh()
 
 def scan_barcode(image):
     """Scan barcode using OpenCV."""
-    # Convert PIL image to OpenCV format
-    image_cv = np.array(image)
-    image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGB2BGR)
-    
-    # Decode barcode
-    detector = cv2.QRCodeDetector()
-    data, _, _ = detector.detectAndDecode(image_cv)
+    # Convert PIL image to a grayscale OpenCV array
+    image_cv = np.array(image.convert("L"))
+    return _decode_barcode_array(image_cv)
+
+# Batch Barcode Scanning
+# Deliveries are scanned as many images (or a zip of them) at once. Images are
+# decoded straight to grayscale, downscaled to BARCODE_MAX_SIDE, and run on
+# a shared thread pool whose workers each keep one QRCodeDetector.
+BARCODE_MAX_SIDE = 1024
+BARCODE_WORKERS = min(os.cpu_count() or 2, 8)
+BARCODE_IMAGE_TYPES = (".jpg", ".jpeg", ".png")
+
+_barcode_worker = threading.local()
+
+def _init_barcode_worker():
+    # One OpenCV thread per worker; the pool provides the parallelism
+    cv2 = lazy_import("cv2")
+    cv2.setNumThreads(1)
+    _barcode_worker.detector = cv2.QRCodeDetector()
+
+def _decode_barcode_array(gray):
+    detector = getattr(_barcode_worker, "detector", None)
+    if detector is None:
+        _init_barcode_worker()
+        detector = _barcode_worker.detector
+    height, width = gray.shape[:2]
+    scale = BARCODE_MAX_SIDE / max(height, width)
+    if scale < 1:
+        cv2 = lazy_import("cv2")
+        small = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        data, _, _ = detector.detectAndDecode(small)
+        if data:
+            return data
+    # Small codes can be lost by downscaling, so fall back to full resolution
+    data, _, _ = detector.detectAndDecode(gray)
     return data if data else None
 
+def decode_barcode_bytes(content):
+    """Decode one encoded image (JPEG/PNG bytes); runs inside a pool worker."""
+    cv2 = lazy_import("cv2")
+    gray = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    return _decode_barcode_array(gray)
+
+@st.cache_resource
+def _barcode_pool():
+    # Threads, not processes: forking the server would copy its locks
+    # mid-use and its frame cache, and spawned workers can't import a
+    # Streamlit script. OpenCV releases the GIL while decoding, so the
+    # threads still decode in parallel.
+    return ThreadPoolExecutor(max_workers=BARCODE_WORKERS, initializer=_init_barcode_worker)
+
+def barcode_images(uploaded_files):
+    """(name, bytes) for every uploaded image, expanding zip archives."""
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(uploaded) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and member.filename.lower().endswith(BARCODE_IMAGE_TYPES):
+                        yield member.filename, archive.read(member)
+        else:
+            yield uploaded.name, uploaded.getvalue()
+
+def scan_barcodes(images):
+    """Decode (name, bytes) images in parallel, yielding (name, barcode) as each finishes."""
+    pool = _barcode_pool()
+    futures = {pool.submit(decode_barcode_bytes, content): name for name, content in images}
+    for future in as_completed(futures):
+        try:
+            barcode = future.result()
+        except Exception:
+            barcode = None
+        yield futures[future], barcode
+
 # Function to get product of the week
-def get_product_of_the_week():
-    # Load sales data
-    sales_file = "data/sales.csv"
-    df = load_from_csv(sales_file)
+def get_product_of_the_week(n=LEADERBOARD_SIZE):
+    # Read this week's board instead of scanning the sales history
+    top = get_sales_leaderboard().top("product", n, week=week_start(date.today()))
     
-    if df.empty:
-        return None, None
+    if not top:
+        return None, None, []
     
-    # Find the best-selling product
-    best_product = df["Product Name"].value_counts().idxmax()
+    best_product = top[0][0]
     
     # Load inventory data to get the product image
     inventory_file = "data/inventory.csv"
-    inventory_df = load_from_csv(inventory_file)
-    
-    if inventory_df.empty:
-        return best_product, None
+    product_row = load_from_csv(inventory_file, where={"Product Name": best_product})
     
     # Get the product image (assuming the image filename is stored in the inventory data)
-    product_row = inventory_df[inventory_df["Product Name"] == best_product]
-    if not product_row.empty:
+    if not product_row.empty and "Image" in product_row.columns and pd.notna(product_row.iloc[0]["Image"]):
         product_image = product_row.iloc[0]["Image"]  # Assuming "Image" column contains the filename
-        return best_product, product_image
+        return best_product, product_image, top
     else:
-        return best_product, None
+        return best_product, None, top
 
 # Function to get seller of the week
-def get_seller_of_the_week():
-    # Load sales data
-    sales_file = "data/sales.csv"
-    df = load_from_csv(sales_file)
+def get_seller_of_the_week(n=LEADERBOARD_SIZE):
+    # Read this week's board instead of scanning the sales history
+    top = get_sales_leaderboard().top("customer", n, week=week_start(date.today()))
     
-    if df.empty:
-        return None, None
+    if not top:
+        return None, None, []
     
-    # Find the best-performing seller
-    best_seller = df["Customer Name"].value_counts().idxmax()
+    best_seller = top[0][0]
     
     # Load seller data to get the seller's photo (assuming a "sellers.csv" file exists)
     sellers_file = "data/sellers.csv"
-    sellers_df = load_from_csv(sellers_file)
-    
-    if sellers_df.empty:
-        return best_seller, None
+    seller_row = load_from_csv(sellers_file, where={"Customer Name": best_seller})
     
     # Get the seller's photo (assuming "Photo" column contains the filename)
-    seller_row = sellers_df[sellers_df["Customer Name"] == best_seller]
-    if not seller_row.empty:
+    if not seller_row.empty and "Photo" in seller_row.columns and pd.notna(seller_row.iloc[0]["Photo"]):
         seller_photo = seller_row.iloc[0]["Photo"]
-        return best_seller, seller_photo
+        return best_seller, seller_photo, top
     else:
-        return best_seller, None
+        return best_seller, None, top
+
+def display_leaderboard(top, unit):
+    # Runners-up below the winner, e.g. "2. Soap — 14 sales, Kes 3,200.00"
+    for rank, (name, count, revenue) in enumerate(top[1:], start=2):
+        st.sidebar.caption(f"{rank}. {name} — {count} {unit}, Kes {revenue:,.2f}")
 
 # Main Function
 def main():
     st.set_page_config(page_title="🌐Verse ERP", layout="wide")
+    begin_rerun()
+    record_startup_imports()
     
     # Sidebar Navigation
     st.sidebar.title("🌐Verse ERP")
     
-    menu = {
-        "Home": home,
-        "Production Management": production_management,
-        "Inventory Management": inventory_management,
-        "Point of Sale (POS)": pos_module,
-        "Sales & Marketing": sales_marketing,
-        "Personnel Management": personnel_management,
-        "Financial Management": financial_management,
-        "Analytics & Reporting": analytics_reporting,
-    }
-    
-    choice = st.sidebar.radio("Select Module", list(menu.keys()), key="main_menu")
-    
-    # Initialize submenu variable
-    submenu = None
+    choice = st.sidebar.radio("Select Module", list(MODULES), key="main_menu")
+    module = MODULES[choice]
     
     # Display submenus for the selected module
-    if choice in ["Production Management", "Inventory Management", "Point of Sale (POS)", "Sales & Marketing", "Personnel Management", "Financial Management", "Analytics & Reporting"]:
-        if choice == "Production Management":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Production Tracking", "Workflow Management", "Product Formulations"],
-                key="production_submenu"
-            )
-        elif choice == "Inventory Management":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Stock Levels", "Reorder Alerts", "Barcode Management"],
-                key="inventory_submenu"
-            )
-        elif choice == "Point of Sale (POS)":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Process Sale", "View Sales History"],
-                key="pos_submenu"
-            )
-        elif choice == "Sales & Marketing":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Sales Performance", "Customer Insights", "Campaign Management"],
-                key="sales_submenu"
-            )
-        elif choice == "Personnel Management":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Employee Records", "Payroll Processing", "Attendance Tracking"],
-                key="personnel_submenu"
-            )
-        elif choice == "Financial Management":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Revenue Tracking", "Expense Tracking", "Financial Reports"],
-                key="financial_submenu"
-            )
-        elif choice == "Analytics & Reporting":
-            submenu = st.sidebar.radio(
-                "Select Submenu",
-                ["Sales Analytics", "Inventory Analytics", "Financial Analytics"],
-                key="analytics_submenu"
-            )
+    submenu = None
+    if module["submenus"]:
+        submenu = st.sidebar.radio("Select Submenu", module["submenus"], key=module["key"])
     
     # Add a separator (dotted lines)
     st.sidebar.markdown("---")
     
     # Product of the Week Section
     st.sidebar.subheader("Product of the Week 🏆")
-    product_name, product_image = get_product_of_the_week()
+    with span("render", "sidebar:product"):
+        product_name, product_image, top_products = get_product_of_the_week()
     
     if product_name:
         st.sidebar.write(f"**{product_name}** is this week's top product!")
@@ -180,15 +3672,17 @@ def main():
             )
         else:
             st.sidebar.write("No image available for this product.")
+        display_leaderboard(top_products, "sales")
     else:
-        st.sidebar.write("No sales data available to determine the product of the week.")
+        st.sidebar.write("No sales recorded this week to determine the product of the week.")
     
     # Add another separator
     st.sidebar.markdown("---")
     
     # Seller of the Week Section
     st.sidebar.subheader("Seller of the Week 🌟")
-    seller_name, seller_photo = get_seller_of_the_week()
+    with span("render", "sidebar:seller"):
+        seller_name, seller_photo, top_sellers = get_seller_of_the_week()
     
     if seller_name:
         st.sidebar.write(f"**{seller_name}** is this week's top seller!")
@@ -203,14 +3697,23 @@ def main():
             )
         else:
             st.sidebar.write("No photo available for this seller.")
+        display_leaderboard(top_sellers, "sales")
     else:
-        st.sidebar.write("No sales data available to determine the seller of the week.")
+        st.sidebar.write("No sales recorded this week to determine the seller of the week.")
     
-    # Call the selected function
-    if submenu:
-        menu[choice](submenu)  # Pass the submenu selection to the module function
-    else:
-        menu[choice]()  # Call the module function without submenu
+    # Call the selected function, loading what its page needs on first use
+    page = f"{choice} / {submenu}" if submenu else choice
+    for name in PAGE_REQUIRES.get((choice, submenu), []):
+        lazy_import(name, page)
+    with span("render", page):
+        if submenu:
+            module["page"](submenu)  # Pass the submenu selection to the module function
+        else:
+            module["page"]()  # Call the module function without submenu
+    
+    write_queue_caption()
+    developer_panel()
+    end_rerun(page)
 
 # Home Page
 def home():
@@ -243,48 +3746,35 @@ def production_management(submenu=None):
     
     if submenu == "Production Tracking":
         st.subheader("Production Tracking")
-        # Load or initialize production data
+        # Display production data, one page at a time
         production_file = "data/production.csv"
-        df = load_from_csv(production_file)
-        
-        if df.empty:
-            df = pd.DataFrame({
-                "Batch ID": [],
-                "Product Name": [],
-                "Raw Materials Used": [],
-                "Quantity Produced": [],
-                "Production Date": [],
-                "Status": []
-            })
-        
-        # Display production data
-        display_dataframe(df, "Production Batches")
+        display_table(production_file, "Production Batches")
         
         # Add new production batch
         st.subheader("Add New Production Batch")
         with st.form("production_form"):
             product_name = st.text_input("Product Name", placeholder="Enter product name")
-            raw_materials = st.text_area("Raw Materials Used", placeholder="List raw materials")
+            raw_materials = st.text_area("Raw Materials Used", placeholder="List raw materials, or leave blank to use the product's formulation")
             quantity = st.number_input("Quantity Produced", min_value=1)
             production_date = st.date_input("Production Date")
             status = st.selectbox("Status", ["Scheduled", "In Progress", "Completed"])
             submit = st.form_submit_button("Add Batch")
             
             if submit:
+                if product_name and not raw_materials:
+                    raw_materials = get_formulations().describe(product_name, quantity)
                 if not product_name or not raw_materials:
                     st.error("Please fill in all fields.")
                 else:
                     new_batch = {
-                        "Batch ID": f"B{len(df) + 1:03d}",
                         "Product Name": product_name,
                         "Raw Materials Used": raw_materials,
                         "Quantity Produced": quantity,
                         "Production Date": production_date.strftime("%Y-%m-%d"),
                         "Status": status
                     }
-                    df = df.append(new_batch, ignore_index=True)
-                    save_to_csv(df, production_file)
-                    st.success(f"Production batch for {product_name} added successfully!")
+                    new_batch, = write_rows(production_file, [new_batch], id_column="Batch ID", id_prefix="B")
+                    st.success(f"Production batch {new_batch['Batch ID']} for {product_name} added successfully!")
     
     elif submenu == "Workflow Management":
         st.subheader("Workflow Management")
@@ -293,8 +3783,65 @@ def production_management(submenu=None):
     
     elif submenu == "Product Formulations":
         st.subheader("Product Formulations")
-        st.write("Store and manage product formulations.")
-        # Add product formulations functionality here
+        st.write("Components per unit of each product; components with formulations of their own are sub-assemblies.")
+        formulations = get_formulations()
+        products = formulations.products()
+        
+        if not products:
+            st.info("No formulations yet.")
+        else:
+            product = st.selectbox("Product", products, key="formulation_product")
+            col1, col2 = st.columns(2)
+            col1.write("Components")
+            col1.dataframe(formulations.components(product), hide_index=True)
+            try:
+                per_unit, _ = formulations.requirements(pd.DataFrame({"Product Name": [product], "Quantity Produced": [1]}))
+            except ValueError as exc:
+                # Only a hand-edited table can hold a cycle; saving a line refuses one
+                st.error(str(exc))
+            else:
+                col2.write(f"Raw materials per unit ({formulations.depth(product)} level(s) deep)")
+                col2.dataframe(per_unit[["Material", "Required"]].rename(columns={"Required": "Quantity"}), hide_index=True)
+        
+        # Add, change or remove a line
+        st.subheader("Edit Formulation")
+        with st.form("formulation_form"):
+            product_name = st.text_input("Product Name", placeholder="Product or sub-assembly made")
+            component = st.text_input("Component", placeholder="Raw material or sub-assembly used")
+            quantity = st.number_input("Quantity per Unit", min_value=0.0, step=0.1, format="%.3f", help="0 removes the component from the formulation.")
+            submit = st.form_submit_button("Save Line")
+            
+            if submit:
+                product_name, component = product_name.strip(), component.strip()
+                if not product_name or not component:
+                    st.error("Please fill in all fields.")
+                elif formulations.creates_cycle(product_name, component):
+                    st.error(f"{component} is made from {product_name}; it can't also be one of its components.")
+                else:
+                    line = save_formulation_line(product_name, component, quantity)
+                    action = "removed from" if not quantity else "saved for"
+                    st.success(f"{component} {action} {product_name} (line {line['Line ID']}).")
+        
+        # Material requirements of the batches not yet started
+        st.subheader("Material Requirements")
+        st.write(f"Raw materials for batches that are {' or '.join(MRP_OPEN_STATUSES).lower()}, netted against stock on hand.")
+        started = time.perf_counter()
+        try:
+            plan, unplanned, batches = material_plan()
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            elapsed = time.perf_counter() - started
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Open Batches", f"{batches:,}")
+            col2.metric("Materials Needed", f"{len(plan):,}")
+            col3.metric("Materials Short", f"{int((plan['Shortfall'] > 0).sum()):,}")
+            if unplanned:
+                st.warning(f"No formulation for {', '.join(map(str, unplanned[:10]))}{' and more' if len(unplanned) > 10 else ''}; their batches are left out.")
+            if not plan.empty:
+                st.dataframe(plan, hide_index=True)
+                st.download_button("Download Requirements", plan.to_csv(index=False), "material_requirements.csv", "text/csv")
+            st.caption(f"Planned in {elapsed * 1000:,.0f} ms.")
 
 # Inventory Management Module
 def inventory_management(submenu=None):
@@ -302,24 +3849,9 @@ def inventory_management(submenu=None):
     
     if submenu == "Stock Levels":
         st.subheader("Stock Levels")
-        # Load or initialize inventory data
+        # Display inventory data, one page at a time
         inventory_file = "data/inventory.csv"
-        df = load_from_csv(inventory_file)
-        
-        if df.empty:
-            df = pd.DataFrame({
-                "Product ID": [],
-                "Product Name": [],
-                "Stock Quantity": [],
-                "Reorder Level": [],
-                "Last Restocked": [],
-                "Expiration Date": [],
-                "Supplier": [],
-                "Barcode": []
-            })
-        
-        # Display inventory data
-        display_dataframe(df, "Inventory Levels")
+        display_table(inventory_file, "Inventory Levels")
         
         # Add new inventory item
         st.subheader("Add New Inventory Item")
@@ -330,48 +3862,127 @@ def inventory_management(submenu=None):
             last_restocked = st.date_input("Last Restocked Date")
             expiration_date = st.date_input("Expiration Date")
             supplier = st.text_input("Supplier Name", placeholder="Enter supplier name")
-            barcode = generate_barcode()
+            unit_price = st.number_input("Unit Price", min_value=0.0)
+            new_product = st.checkbox("New product", help="Add it even if its name resembles an existing product.")
             submit = st.form_submit_button("Add to Inventory")
             
             if submit:
+                search = get_product_search()
+                # A new lot of a known product keeps the stored spelling
+                product_name = search.exact_name(product_name) or product_name.strip()
+                similar = [] if new_product or search.exact_name(product_name) else search.names(product_name, 3)
                 if not product_name or not supplier:
                     st.error("Please fill in all fields.")
                 elif reorder_level >= stock_quantity:
                     st.error("Reorder Level must be less than Stock Quantity.")
+                elif similar:
+                    st.warning(f"Similar products exist: {', '.join(similar)}. Use one of those names, or tick New product to add {product_name} anyway.")
                 else:
+                    # Drawn at submit time so the code is unique among saved items
+                    barcode = generate_barcode()
                     new_item = {
-                        "Product ID": f"P{len(df) + 1:03d}",
                         "Product Name": product_name,
                         "Stock Quantity": stock_quantity,
                         "Reorder Level": reorder_level,
                         "Last Restocked": last_restocked.strftime("%Y-%m-%d"),
                         "Expiration Date": expiration_date.strftime("%Y-%m-%d"),
                         "Supplier": supplier,
-                        "Barcode": barcode
+                        "Barcode": barcode,
+                        "Unit Price": unit_price
                     }
-                    df = df.append(new_item, ignore_index=True)
-                    save_to_csv(df, inventory_file)
-                    st.success(f"{product_name} added to inventory successfully! Generated Barcode: {barcode}")
+                    new_item, = write_rows(inventory_file, [new_item], id_column="Product ID", id_prefix="P")
+                    st.success(f"{product_name} added to inventory as {new_item['Product ID']}! Generated Barcode: {barcode}")
     
     elif submenu == "Reorder Alerts":
         st.subheader("Reorder Alerts")
-        st.write("View and manage reorder alerts.")
-        # Add reorder alerts functionality here
+        st.write("Items at or below their reorder level, fewest days of stock left first.")
+        alerts = get_reorder_engine().alerts(get_sales_velocity())
+        st.metric("Items to Reorder", len(alerts))
+        if alerts.empty:
+            st.success("All items are above their reorder levels.")
+        else:
+            st.caption(f"Days of cover use average daily sales over the last {REORDER_VELOCITY_DAYS} days.")
+            st.dataframe(alerts.head(500))
+            
+            # Receive stock for an alerted item
+            st.subheader("Restock Item")
+            with st.form("restock_form"):
+                labels = {f"{row['Product ID']} — {row['Product Name']}": row for _, row in alerts.head(500).iterrows()}
+                choice = st.selectbox("Item", list(labels))
+                quantity = st.number_input("Quantity Received", min_value=1, value=int(labels[choice]["Suggested Order"]))
+                restocked = st.date_input("Restock Date")
+                submit = st.form_submit_button("Restock")
+                
+                if submit:
+                    row = adjust_stock(labels[choice]["Product ID"], quantity, restocked)
+                    if row is None:
+                        st.error("That item is no longer in the inventory.")
+                    else:
+                        st.success(f"{row['Product Name']} restocked; {row['Stock Quantity']} in stock.")
     
     elif submenu == "Barcode Management":
         st.subheader("Barcode Management")
         st.write("Scan and manage barcodes.")
         
-        # Barcode scanning
-        uploaded_file = st.file_uploader("Upload Barcode Image", type=["jpg", "jpeg", "png"])
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Uploaded Barcode", use_column_width=True)
-            barcode = scan_barcode(image)
-            if barcode:
-                st.success(f"Scanned Barcode: {barcode}")
-            else:
-                st.error("No barcode detected.")
+        mode = st.radio("Scan Mode", ["Single Image", "Batch Scan"], horizontal=True)
+        
+        if mode == "Batch Scan":
+            # Receiving a delivery: many labels (or a zip of them) at once
+            uploaded_files = st.file_uploader(
+                "Upload Barcode Images or a Zip Archive",
+                type=["jpg", "jpeg", "png", "zip"],
+                accept_multiple_files=True,
+            )
+            if uploaded_files and st.button("Scan All"):
+                images = list(barcode_images(uploaded_files))
+                index = get_barcode_index()
+                progress = st.progress(0.0, text=f"Scanning {len(images)} images...")
+                table = st.empty()
+                results = []
+                started = time.perf_counter()
+                for done, (name, barcode) in enumerate(scan_barcodes(images), start=1):
+                    product = index.lookup(barcode) if barcode else None
+                    results.append({
+                        "Image": name,
+                        "Barcode": barcode,
+                        "Product ID": product["Product ID"] if product else None,
+                        "Product Name": product["Product Name"] if product else None,
+                        "Unit Price": product["Unit Price"] if product else None,
+                    })
+                    elapsed = time.perf_counter() - started
+                    progress.progress(done / len(images), text=f"{done}/{len(images)} images, {done / elapsed:,.1f} images/s")
+                    if done % 25 == 0 or done == len(images):
+                        table.dataframe(pd.DataFrame(results))
+                elapsed = time.perf_counter() - started
+                if results:
+                    results_df = pd.DataFrame(results)
+                    col1, col2, col3, col4 = st.columns(4)
+                    col1.metric("Images", len(results_df))
+                    col2.metric("Decoded", int(results_df["Barcode"].notna().sum()))
+                    col3.metric("Matched to Inventory", int(results_df["Product ID"].notna().sum()))
+                    col4.metric("Throughput", f"{len(results_df) / elapsed:,.1f} images/s")
+                    st.download_button("Download Results", results_df.to_csv(index=False), "barcode_scan.csv", "text/csv")
+                else:
+                    st.warning("No images found in the upload.")
+        else:
+            # Barcode scanning
+            uploaded_file = st.file_uploader("Upload Barcode Image", type=["jpg", "jpeg", "png"])
+            if uploaded_file is not None:
+                image = lazy_import("PIL.Image").open(uploaded_file)
+                st.image(image, caption="Uploaded Barcode", use_column_width=True)
+                barcode = scan_barcode(image)
+                if barcode:
+                    st.success(f"Scanned Barcode: {barcode}")
+                    product = get_barcode_index().lookup(barcode)
+                    if product:
+                        st.write(f"**{product['Product Name']}** ({product['Product ID']})")
+                    else:
+                        st.warning("This barcode is not in the inventory.")
+                else:
+                    st.error("No barcode detected.")
+
+    elif submenu == "Bulk Import":
+        bulk_import_page("data/inventory.csv", "Inventory")
 
 # Point of Sale (POS) Module
 def pos_module(submenu=None):
@@ -380,60 +3991,120 @@ def pos_module(submenu=None):
     
     if submenu == "Process Sale":
         st.subheader("Process Sale")
-        # Load or initialize sales data
-        sales_file = "data/sales.csv"
-        df = load_from_csv(sales_file)
+        inventory_file = "data/inventory.csv"
+        # Lines stay in the session until the basket is checked out in one commit
+        basket = st.session_state.setdefault("pos_basket", [])
+        index = get_barcode_index()
         
-        if df.empty:
-            df = pd.DataFrame({
-                "Sale ID": [],
-                "Product ID": [],
-                "Product Name": [],
-                "Quantity Sold": [],
-                "Total Price": [],
-                "Sale Date": [],
-                "Customer Name": [],
-                "Payment Method": []
-            })
+        def scan_into_basket():
+            # Scanners type the code followed by Enter; each scan adds one unit
+            code = st.session_state["pos_barcode"].strip()
+            st.session_state["pos_barcode"] = ""
+            product = index.lookup(code) if code else None
+            if product is None:
+                st.session_state.setdefault("pos_notices", []).append(("warning", f"Barcode {code} is not in the inventory."))
+            elif product["Unit Price"] is None:
+                st.session_state.setdefault("pos_notices", []).append(("warning", f"{product['Product Name']} has no unit price; add it by name below."))
+            else:
+                add_to_basket(basket, basket_line(product["Product ID"], product["Product Name"], 1, product["Unit Price"]))
+                first, _ = get_expiry_index().fefo(product["Product Name"], 1)
+                if first and first[0][0] != product["Product ID"]:
+                    st.session_state.setdefault("pos_notices", []).append(("info", f"Lot {first[0][0]} of {product['Product Name']} expires sooner and should be sold first."))
         
-        # Process a new sale
-        with st.form("pos_form"):
-            product_name = st.text_input("Product Name", placeholder="Enter product name")
-            quantity_sold = st.number_input("Quantity Sold", min_value=1)
-            total_price = st.number_input("Total Price", min_value=0.0)
-            sale_date = st.date_input("Sale Date")
-            customer_name = st.text_input("Customer Name", placeholder="Enter customer name")
-            payment_method = st.selectbox("Payment Method", ["Cash", "Card", "Mobile Money"])
-            submit = st.form_submit_button("Process Sale")
+        st.text_input("Barcode", placeholder="Scan or type a barcode", key="pos_barcode", on_change=scan_into_basket)
+        barcode_image = st.file_uploader("Or upload a barcode image", type=["jpg", "jpeg", "png"], key="pos_barcode_image")
+        if barcode_image is not None:
+            barcode = scan_barcode(lazy_import("PIL.Image").open(barcode_image))
+            product = index.lookup(barcode) if barcode else None
+            if product is None:
+                st.warning("No known barcode found in the image.")
+            elif st.button(f"Add {product['Product Name']} ({product['Product ID']}) to Basket", disabled=product["Unit Price"] is None):
+                add_to_basket(basket, basket_line(product["Product ID"], product["Product Name"], 1, product["Unit Price"]))
+        for kind, message in st.session_state.pop("pos_notices", []):
+            getattr(st, kind)(message)
+        
+        # Items without a label are added by name and drawn first-expired-first-out;
+        # names are picked from the product index so a typo doesn't start a new product
+        query = st.text_input("Find Product", placeholder="Name, ID, supplier or barcode", key="pos_product_search")
+        options = {name: name for name in get_product_search().names(query)} if query else {}
+        if query and get_product_search().exact_name(query) is None:
+            options[f"{query.strip()} (not in inventory)"] = query.strip()
+        with st.form("pos_item_form", clear_on_submit=True):
+            col1, col2, col3 = st.columns([3, 1, 1])
+            product_name = options.get(col1.selectbox("Product Name", list(options), placeholder="Find a product above"))
+            quantity = col2.number_input("Quantity", min_value=1)
+            unit_price = col3.number_input("Unit Price", min_value=0.0, help="Leave at 0 to use the inventory price.")
+            add = st.form_submit_button("Add to Basket")
             
-            if submit:
-                if not product_name or not customer_name:
-                    st.error("Please fill in all fields.")
+            if add:
+                if not product_name:
+                    st.error("Please find a product first.")
                 else:
-                    new_sale = {
-                        "Sale ID": f"S{len(df) + 1:03d}",
-                        "Product ID": f"P{len(df) + 1:03d}",  # Placeholder, link to actual product ID
-                        "Product Name": product_name,
-                        "Quantity Sold": quantity_sold,
-                        "Total Price": total_price,
-                        "Sale Date": sale_date.strftime("%Y-%m-%d"),
-                        "Customer Name": customer_name,
-                        "Payment Method": payment_method
-                    }
-                    df = df.append(new_sale, ignore_index=True)
-                    save_to_csv(df, sales_file)
-                    st.success(f"Sale for {product_name} processed successfully!")
+                    if unit_price == 0:
+                        lots, _ = get_expiry_index().fefo(product_name, 1)
+                        price = get_expiry_index().unit_price(lots[0][0]) if lots else None
+                        if price is None:
+                            match = load_from_csv(inventory_file, where={"Product Name": product_name}, columns=["Unit Price"]).dropna()
+                            price = float(match.iloc[0]["Unit Price"]) if not match.empty else None
+                        unit_price = price
+                    if unit_price is None:
+                        st.error(f"No price on record for {product_name}; enter a unit price.")
+                    else:
+                        add_to_basket(basket, basket_line(None, product_name, quantity, unit_price))
+        
+        # Basket
+        st.subheader("Basket")
+        if not basket:
+            st.write("The basket is empty.")
+        else:
+            lines = pd.DataFrame(basket)
+            lines["Line Total"] = (lines["Quantity Sold"] * lines["Unit Price"]).round(2)
+            st.dataframe(lines, hide_index=True)
+            st.metric("Basket Total", f"Kes {lines['Line Total'].sum():,.2f}")
+            col1, col2 = st.columns([3, 1])
+            remove = col1.selectbox("Line", range(len(basket)), format_func=lambda i: f"{i + 1}. {basket[i]['Product Name']} × {basket[i]['Quantity Sold']}")
+            if col2.button("Remove Line"):
+                basket.pop(remove)
+                st.rerun()
+            if st.button("Clear Basket"):
+                basket.clear()
+                st.rerun()
+            
+            with st.form("pos_checkout_form"):
+                sale_date = st.date_input("Sale Date")
+                customer_name = st.text_input("Customer Name", placeholder="Enter customer name")
+                payment_method = st.selectbox("Payment Method", ["Cash", "Card", "Mobile Money"])
+                checkout = st.form_submit_button("Checkout")
+                
+                if checkout:
+                    if not customer_name:
+                        st.error("Please enter the customer name.")
+                    else:
+                        # Sale lines, stock and revenue land together or not at all
+                        try:
+                            written = checkout_basket(basket, customer_name, payment_method, sale_date)
+                        except ValueError as exc:
+                            st.error(f"{exc} Adjust the basket or restock first.")
+                        else:
+                            sales = written["data/sales.csv"]
+                            revenue, = written["data/financial.csv"]
+                            basket_lines = len(basket)
+                            basket.clear()
+                            notices = st.session_state.setdefault("pos_notices", [])
+                            notices.append(("success", f"Checked out {basket_lines} lines as {len(sales)} sales ({sales[0]['Sale ID']}–{sales[-1]['Sale ID']}) for Kes {revenue['Amount']:,.2f}."))
+                            for item in written.get("data/inventory.csv", []):
+                                if item["Stock Quantity"] <= pd.to_numeric(item.get("Reorder Level"), errors="coerce"):
+                                    notices.append(("warning", f"{item['Product Name']} ({item['Product ID']}) is down to {item['Stock Quantity']} in stock and should be reordered."))
+                            st.rerun()
     
     elif submenu == "View Sales History":
         st.subheader("Sales History")
-        # Load sales data
+        # Display sales data, one page at a time
         sales_file = "data/sales.csv"
-        df = load_from_csv(sales_file)
-        
-        if df.empty:
-            st.warning("No sales data available.")
-        else:
-            display_dataframe(df, "Sales Transactions")
+        display_table(sales_file, "Sales Transactions")
+    
+    elif submenu == "Bulk Import":
+        bulk_import_page("data/sales.csv", "Sales History")
 
 # Sales & Marketing Module
 def sales_marketing(submenu=None):
@@ -441,35 +4112,62 @@ def sales_marketing(submenu=None):
     
     if submenu == "Sales Performance":
         st.subheader("Sales Performance")
-        # Load sales data
-        sales_file = "data/sales.csv"
-        df = load_from_csv(sales_file)
+        # Trends come from the pre-aggregated rollups, not raw sales
+        date_range = select_date_range("sales_performance_period")
         
-        if df.empty:
+        if get_sales_rollups().series("month").empty:
             st.warning("No sales data available.")
         else:
             # Display sales trends
             st.subheader("Sales Trends")
-            st.line_chart(df.set_index("Sale Date")["Total Price"])
+            sales_trend_chart("sales_performance", date_range)
+            
+            # Slice and dice from the sales cube
+            st.subheader("Drill Down")
+            sales_drilldown("sales_cube", date_range)
     
     elif submenu == "Customer Insights":
         st.subheader("Customer Insights")
-        # Load sales data
-        sales_file = "data/sales.csv"
-        df = load_from_csv(sales_file)
+        # Purchases per customer come from the sales cube
+        customer_data = get_sales_cube().query(["Customer Name"])
         
-        if df.empty:
+        if customer_data.empty:
             st.warning("No sales data available.")
         else:
             # Customer insights
-            customer_data = df["Customer Name"].value_counts().reset_index()
-            customer_data.columns = ["Customer Name", "Number of Purchases"]
-            st.dataframe(customer_data)
+            customer_data = customer_data.sort_values("Sales", ascending=False, kind="stable")
+            customer_data = customer_data.rename(columns={"Sales": "Number of Purchases", "Revenue": "Total Spent"})
+            st.dataframe(customer_data, hide_index=True)
+            
+            # Recency / frequency / monetary segments
+            st.subheader("Customer Segments")
+            profiles = get_customer_profiles()
+            summary = profiles.segments()
+            st.dataframe(summary, hide_index=True)
+            st.bar_chart(summary.set_index("Segment")["Customers"])
+            segment = st.selectbox("Customers In", summary["Segment"], key="insights_segment")
+            st.dataframe(profiles.audience([segment]).head(500), hide_index=True)
     
     elif submenu == "Campaign Management":
         st.subheader("Campaign Management")
-        st.write("Manage marketing campaigns.")
-        # Add campaign management functionality here
+        st.write("Pick a campaign audience from the customer segments.")
+        profiles = get_customer_profiles()
+        summary = profiles.segments()
+        if not summary["Customers"].sum():
+            st.warning("No sales data available.")
+        else:
+            counts = dict(zip(summary["Segment"], summary["Customers"]))
+            campaign = st.text_input("Campaign Name", placeholder="e.g. December win-back")
+            segments = st.multiselect("Segments", list(counts), default=["At Risk", "Can't Lose"], format_func=lambda segment: f"{segment} ({counts[segment]:,})")
+            col1, col2 = st.columns(2)
+            payment = col1.selectbox("Preferred Payment", ["Any"] + profiles.payment_methods())
+            min_spent = col2.number_input("Minimum Total Spent", min_value=0.0, step=100.0)
+            audience = profiles.audience(segments, None if payment == "Any" else payment, min_spent)
+            st.metric("Audience Size", f"{len(audience):,}")
+            if not audience.empty:
+                st.dataframe(audience.head(500), hide_index=True)
+                filename = re.sub(r"[^0-9A-Za-z]+", "_", campaign).strip("_") or "campaign"
+                st.download_button("Download Audience", audience.to_csv(index=False), f"{filename}_audience.csv", "text/csv")
 
 # Personnel Management Module
 def personnel_management(submenu=None):
@@ -477,22 +4175,9 @@ def personnel_management(submenu=None):
     
     if submenu == "Employee Records":
         st.subheader("Employee Records")
-        # Load or initialize employee data
+        # Display employee data, one page at a time
         employees_file = "data/employees.csv"
-        df = load_from_csv(employees_file)
-        
-        if df.empty:
-            df = pd.DataFrame({
-                "Employee ID": [],
-                "Employee Name": [],
-                "Role": [],
-                "Salary": [],
-                "Join Date": [],
-                "Attendance": []
-            })
-        
-        # Display employee data
-        display_dataframe(df, "Employee Records")
+        display_table(employees_file, "Employee Records")
         
         # Add new employee
         st.subheader("Add New Employee")
@@ -509,26 +4194,100 @@ def personnel_management(submenu=None):
                     st.error("Please fill in all fields.")
                 else:
                     new_employee = {
-                        "Employee ID": f"E{len(df) + 1:03d}",
                         "Employee Name": employee_name,
                         "Role": role,
                         "Salary": salary,
                         "Join Date": join_date.strftime("%Y-%m-%d"),
                         "Attendance": attendance
                     }
-                    df = df.append(new_employee, ignore_index=True)
-                    save_to_csv(df, employees_file)
-                    st.success(f"Employee {employee_name} added successfully!")
+                    new_employee, = write_rows(employees_file, [new_employee], id_column="Employee ID", id_prefix="E")
+                    st.success(f"Employee {employee_name} added successfully as {new_employee['Employee ID']}!")
     
     elif submenu == "Payroll Processing":
         st.subheader("Payroll Processing")
-        st.write("Process employee payroll.")
-        # Add payroll processing functionality here
+        st.write("Run payroll for a month. Salaries are monthly and prorated by attendance.")
+        payslips_file = "data/payslips.csv"
+        today = date.today().replace(day=1)
+        periods = [(pd.Timestamp(today) - pd.DateOffset(months=i)).strftime("%Y-%m") for i in range(12)]
+        period = st.selectbox("Pay Period", periods)
+        recompute_all = st.checkbox("Recompute every employee", help="By default only employees whose salary, attendance or name changed since their last payslip for this period get a new one.")
+        
+        if st.button("Run Payroll"):
+            started = time.perf_counter()
+            batch, unchanged = run_payroll(period, recompute_all)
+            elapsed = time.perf_counter() - started
+            if batch.empty:
+                st.info(f"All {unchanged:,} payslips for {period} are up to date.")
+            else:
+                st.success(f"Issued {len(batch):,} payslips for {period} in {elapsed:,.2f}s ({unchanged:,} unchanged).")
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Gross Pay", f"Kes {batch['Gross Pay'].sum():,.2f}")
+                col2.metric("Deductions", f"Kes {batch['Total Deductions'].sum():,.2f}")
+                col3.metric("Net Pay", f"Kes {batch['Net Pay'].sum():,.2f}")
+        
+        # Every run's payslips stay on record; the latest per employee applies
+        display_table(payslips_file, f"Payslips for {period}", where={"Pay Period": period}, key=f"payslips_{period}")
     
     elif submenu == "Attendance Tracking":
         st.subheader("Attendance Tracking")
-        st.write("Track employee attendance.")
-        # Add attendance tracking functionality here
+        st.write("Record daily attendance; each employee's Attendance (%) is derived from this month's records.")
+        employees_file = "data/employees.csv"
+        store = get_attendance_store()
+        employees = load_from_csv(employees_file, columns=["Employee ID", "Employee Name"])
+        names = dict(zip(employees["Employee ID"].astype(str), employees["Employee Name"])) if not employees.empty else {}
+        
+        # Bulk check-in/check-out import from a clock or access-control export
+        st.subheader("Import Clock Events")
+        uploaded = st.file_uploader("Upload Check-in/Check-out CSV (Employee ID, Timestamp, optional Event)", type=["csv"], key="attendance_upload")
+        if uploaded is not None and st.button("Import Events"):
+            events = pd.read_csv(uploaded, dtype=str)
+            missing = [column for column in ["Employee ID", "Timestamp"] if column not in events.columns]
+            if missing:
+                st.error(f"Missing required columns: {', '.join(missing)}")
+            else:
+                added = ingest_clock_events(events)
+                updated = sync_attendance_column()
+                st.success(f"Recorded {added:,} new attendance days; {updated:,} employee records updated.")
+        
+        # Record a day by hand
+        st.subheader("Record Attendance")
+        with st.form("attendance_form"):
+            day = st.date_input("Date", key="attendance_day")
+            present = st.multiselect("Present", list(names), format_func=lambda employee_id: f"{employee_id} — {names[employee_id]}")
+            submit = st.form_submit_button("Save Attendance")
+            
+            if submit:
+                if not present:
+                    st.error("Select at least one employee.")
+                else:
+                    store.record(present, [day] * len(present))
+                    sync_attendance_column()
+                    st.success(f"Attendance saved for {len(present)} employees on {day}.")
+        
+        # Who was away on a given day
+        st.subheader("Absentees")
+        absent_day = st.date_input("Absentees On", key="absentee_day")
+        if absent_day.weekday() >= 5:
+            st.info("That day is a weekend.")
+        else:
+            present_ids = store.present(absent_day)
+            absent = employees[~employees["Employee ID"].astype(str).isin(present_ids)] if not employees.empty else employees
+            st.write(f"{len(absent)} of {len(employees)} employees absent.")
+            st.dataframe(absent)
+        
+        # One employee's record this year
+        if names:
+            st.subheader("Employee Attendance")
+            employee_id = st.selectbox("Employee", list(names), format_func=lambda employee_id: f"{employee_id} — {names[employee_id]}")
+            today = date.today()
+            year_to_date = store.attendance(today.replace(month=1, day=1), today).get(employee_id, 0.0)
+            month_to_date = store.attendance(today.replace(day=1), today).get(employee_id, 0.0)
+            current, longest = store.streaks(employee_id, today)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("This Month", f"{month_to_date:.1f}%")
+            col2.metric("Year to Date", f"{year_to_date:.1f}%")
+            col3.metric("Current Streak", f"{current} days")
+            col4.metric("Longest Streak", f"{longest} days")
 
 # Financial Management Module
 def financial_management(submenu=None):
@@ -536,41 +4295,15 @@ def financial_management(submenu=None):
     
     if submenu == "Revenue Tracking":
         st.subheader("Revenue Tracking")
-        # Load financial data
+        # Display revenue data, one page at a time
         financial_file = "data/financial.csv"
-        df = load_from_csv(financial_file)
-        
-        if df.empty:
-            df = pd.DataFrame({
-                "Transaction ID": [],
-                "Description": [],
-                "Amount": [],
-                "Type": [],
-                "Date": []
-            })
-        
-        # Display revenue data
-        revenue_df = df[df["Type"] == "Revenue"]
-        display_dataframe(revenue_df, "Revenue Transactions")
+        display_table(financial_file, "Revenue Transactions", where={"Type": "Revenue"}, key="revenue_table")
     
     elif submenu == "Expense Tracking":
         st.subheader("Expense Tracking")
-        # Load financial data
+        # Display expense data, one page at a time
         financial_file = "data/financial.csv"
-        df = load_from_csv(financial_file)
-        
-        if df.empty:
-            df = pd.DataFrame({
-                "Transaction ID": [],
-                "Description": [],
-                "Amount": [],
-                "Type": [],
-                "Date": []
-            })
-        
-        # Display expense data
-        expense_df = df[df["Type"] == "Expense"]
-        display_dataframe(expense_df, "Expense Transactions")
+        display_table(financial_file, "Expense Transactions", where={"Type": "Expense"}, key="expense_table")
     
     elif submenu == "Financial Reports":
         st.subheader("Financial Reports")
@@ -583,16 +4316,17 @@ def analytics_reporting(submenu=None):
     
     if submenu == "Sales Analytics":
         st.subheader("Sales Analytics")
-        # Load sales data
+        # Load only the product column for the selected period
         sales_file = "data/sales.csv"
-        df = load_from_csv(sales_file)
+        date_range = select_date_range("sales_analytics_period")
+        df = load_from_csv(sales_file, columns=["Product Name"], date_range=date_range)
         
         if df.empty:
-            st.warning("No sales data available.")
+            st.warning("No sales data available for this period.")
         else:
             # Sales trends
             st.subheader("Sales Trends")
-            st.line_chart(df.set_index("Sale Date")["Total Price"])
+            sales_trend_chart("sales_analytics", date_range)
             
             # Top products
             st.subheader("Top Products")
@@ -602,30 +4336,31 @@ def analytics_reporting(submenu=None):
             
             # Sales Predictions
             st.subheader("Sales Predictions")
-            st.write("Predict future sales using linear regression.")
-            
-            # Prepare data for prediction
-            df["Sale Date"] = pd.to_datetime(df["Sale Date"])
-            df["Days"] = (df["Sale Date"] - df["Sale Date"].min()).dt.days
+            st.write("Predict future daily sales with a linear trend fitted to each product's full history.")
             
-            X = df[["Days"]]
-            y = df["Total Price"]
-            
-            # Train-test split
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-            
-            # Train linear regression model
-            model = LinearRegression()
-            model.fit(X_train, y_train)
-            
-            # Predict future sales
+            # The models are kept up to date as sales come in, so changing
+            # the horizon or the products only re-evaluates the trend lines
+            forecaster = get_sales_forecaster()
             future_days = st.number_input("Enter number of days to predict:", min_value=1, value=30)
-            future_X = np.array(range(df["Days"].max() + 1, df["Days"].max() + 1 + future_days)).reshape(-1, 1)
-            future_y = model.predict(future_X)
+            products = st.multiselect("Products", [name for name in forecaster.names if name != FORECAST_ALL])
+            series = products or [FORECAST_ALL]
+            predictions = forecaster.forecast(future_days, series)
             
             # Display predictions
             st.write(f"Predicted sales for the next {future_days} days:")
-            st.line_chart(pd.DataFrame({"Days": future_X.flatten(), "Predicted Sales": future_y}).set_index("Days"))
+            st.line_chart(predictions)
+            
+            history = forecaster.history(FORECAST_ALL)
+            if len(history) > 1:
+                rmse = np.sqrt(np.mean((history["Actual"].to_numpy(dtype=float) - history["Fitted"].to_numpy(dtype=float)) ** 2))
+                st.caption(f"Trend fit error (RMSE) on daily sales: Kes {rmse:,.2f}")
+            
+            # Every product's forecast comes from the same vectorized pass
+            st.write(f"Top products by predicted sales over the next {future_days} days:")
+            totals = forecaster.forecast(future_days).drop(columns=[FORECAST_ALL]).sum()
+            top_forecast = totals.sort_values(ascending=False).head(10).reset_index()
+            top_forecast.columns = ["Product Name", "Predicted Sales"]
+            st.dataframe(top_forecast)
     
     elif submenu == "Inventory Analytics":
         st.subheader("Inventory Analytics")
@@ -639,23 +4374,105 @@ def analytics_reporting(submenu=None):
             # Stock levels
             st.subheader("Stock Levels")
             st.bar_chart(df.set_index("Product Name")["Stock Quantity"])
+        
+        # Near-expiry stock, straight from the expiry index
+        st.subheader("Near-Expiry Stock")
+        expiry = get_expiry_index()
+        days = st.slider("Expiring Within (Days)", min_value=1, max_value=180, value=30)
+        expiring = expiry.expiring(days)
+        expired = expiry.expired()
+        value = (expiring["Stock Quantity"] * expiring["Unit Price"]).sum()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Lots Expiring", len(expiring))
+        col2.metric("Units Expiring", f"{expiring['Stock Quantity'].sum():,.0f}")
+        col3.metric("Stock Value at Risk", f"Kes {value:,.2f}")
+        if expiring.empty:
+            st.success(f"Nothing in stock expires in the next {days} days.")
+        else:
+            st.dataframe(expiring)
+        if not expired.empty:
+            st.error(f"{len(expired)} lots in stock have already expired.")
+            st.dataframe(expired)
     
     elif submenu == "Financial Analytics":
         st.subheader("Financial Analytics")
         # Load financial data
         financial_file = "data/financial.csv"
-        df = load_from_csv(financial_file)
+        revenue_df = load_from_csv(financial_file, where={"Type": "Revenue"})
+        expense_df = load_from_csv(financial_file, where={"Type": "Expense"})
         
-        if df.empty:
+        if revenue_df.empty and expense_df.empty:
             st.warning("No financial data available.")
         else:
             # Revenue vs Expenses
             st.subheader("Revenue vs Expenses")
-            revenue = df[df["Type"] == "Revenue"]["Amount"].sum()
-            expenses = df[df["Type"] == "Expense"]["Amount"].sum()
+            revenue = revenue_df["Amount"].sum()
+            expenses = expense_df["Amount"].sum()
             st.write(f"Total Revenue: Kes{revenue:,.2f}")
             st.write(f"Total Expenses: Kes{expenses:,.2f}")
             st.write(f"Net Profit: Kes{revenue - expenses:,.2f}")
 
+# Module Registry
+# The sidebar is built from MODULES: each module's page function, its
+# submenus and the widget key holding the chosen submenu. PAGE_REQUIRES
+# names the heavy libraries a page uses, imported when it is first opened.
+# The POS only needs OpenCV when a barcode image is uploaded, so it isn't listed.
+MODULES = {
+    "Home": {"page": home, "submenus": [], "key": None},
+    "Production Management": {
+        "page": production_management,
+        "submenus": ["Production Tracking", "Workflow Management", "Product Formulations"],
+        "key": "production_submenu",
+    },
+    "Inventory Management": {
+        "page": inventory_management,
+        "submenus": ["Stock Levels", "Reorder Alerts", "Barcode Management", "Bulk Import"],
+        "key": "inventory_submenu",
+    },
+    "Point of Sale (POS)": {
+        "page": pos_module,
+        "submenus": ["Process Sale", "View Sales History", "Bulk Import"],
+        "key": "pos_submenu",
+    },
+    "Sales & Marketing": {
+        "page": sales_marketing,
+        "submenus": ["Sales Performance", "Customer Insights", "Campaign Management"],
+        "key": "sales_submenu",
+    },
+    "Personnel Management": {
+        "page": personnel_management,
+        "submenus": ["Employee Records", "Payroll Processing", "Attendance Tracking"],
+        "key": "personnel_submenu",
+    },
+    "Financial Management": {
+        "page": financial_management,
+        "submenus": ["Revenue Tracking", "Expense Tracking", "Financial Reports"],
+        "key": "financial_submenu",
+    },
+    "Analytics & Reporting": {
+        "page": analytics_reporting,
+        "submenus": ["Sales Analytics", "Inventory Analytics", "Financial Analytics"],
+        "key": "analytics_submenu",
+    },
+}
+
+PAGE_REQUIRES = {
+    ("Inventory Management", "Barcode Management"): ["PIL.Image", "cv2"],
+}
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ["migrate-sqlite"]:
+        for filename, rows in import_csv_tables(SqliteStorage(SQLITE_PATH)).items():
+            print(f"{filename}: {rows} rows -> {SQLITE_PATH}")
+    elif sys.argv[1:2] == ["migrate-parquet"]:
+        storage = ParquetStorage()
+        for filename, rows in import_csv_tables(storage).items():
+            print(f"{filename}: {rows} rows -> {storage.snapshot_path(filename)}")
+    elif sys.argv[1:2] == ["export-csv"]:
+        for filename, rows in export_csv_tables(get_storage()).items():
+            print(f"{filename}: {rows} rows exported from {STORAGE_BACKEND}")
+    elif sys.argv[1:2] == ["import-costs"]:
+        for name, seconds in measure_import_costs().items():
+            print(f"{name}: {seconds * 1000:,.0f} ms" if seconds is not None else f"{name}: not installed")
+    else:
+        main()
\ No newline at end of file